@@ -0,0 +1,100 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from itertools import count
+from operator import mul
+
+
+def normalise_vector(vector):
+    """Scale a vector to unit length so a dot product gives cosine similarity"""
+    norm = math.sqrt(sum(x * x for x in vector))
+    return [x / norm for x in vector] if norm else list(vector)
+
+
+class AnswerCache:
+    """Per-company cache of generated answers, looked up by question embedding similarity.
+
+    version(company), if given, returns a stamp that changes whenever the company's documents change in
+    any process (e.g. the manifest file's mtime); a company's answers are dropped as soon as it moves.
+    """
+
+    def __init__(self, similarity_threshold=0.95, ttl_seconds=3600, max_entries_per_company=256, version=None):
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries_per_company = max_entries_per_company
+        self.version = version
+
+        self._companies = {}
+        self._versions = {}
+        self._ids = count()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def _expire(self, entries, now):
+        # Entries are kept in insertion/use order, but TTL is measured from creation so check them all
+        for entry_id in [entry_id for entry_id, entry in entries.items() if now - entry["created"] > self.ttl_seconds]:
+            del entries[entry_id]
+            self._stats["evictions"] += 1
+
+    def _check_version(self, company):
+        # Another process (upload page, bulk_ingest, an import) may have changed the documents
+        if self.version is None:
+            return
+        version = self.version(company)
+        if self._versions.get(company) != version:
+            if self._companies.pop(company, None):
+                self._stats["invalidations"] += 1
+            self._versions[company] = version
+
+    def lookup(self, company, question_vector):
+        """Return the cached entry most similar to the question, or None if nothing is close enough"""
+        vector = normalise_vector(question_vector)
+        with self._lock:
+            self._check_version(company)
+            entries = self._companies.get(company)
+            best_id, best_score = None, -1.0
+            if entries:
+                self._expire(entries, time.time())
+                for entry_id, entry in entries.items():
+                    score = sum(map(mul, vector, entry["vector"]))
+                    if score > best_score:
+                        best_id, best_score = entry_id, score
+
+            if best_id is None or best_score < self.similarity_threshold:
+                self._stats["misses"] += 1
+                return None
+
+            # Mark the entry as recently used so LRU eviction keeps popular answers
+            entries.move_to_end(best_id)
+            self._stats["hits"] += 1
+            return dict(entries[best_id], similarity=best_score)
+
+    def store(self, company, question, question_vector, answer, documents):
+        """Cache an answer together with the documents it was generated from"""
+        with self._lock:
+            self._check_version(company)
+            entries = self._companies.setdefault(company, OrderedDict())
+            entries[next(self._ids)] = {
+                "question": question,
+                "vector": normalise_vector(question_vector),
+                "answer": answer,
+                "documents": documents,
+                "created": time.time(),
+            }
+            while len(entries) > self.max_entries_per_company:
+                entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def invalidate(self, company):
+        """Forget every cached answer for a company, e.g. after its documents change"""
+        with self._lock:
+            if self._companies.pop(company, None):
+                self._stats["invalidations"] += 1
+
+    def stats(self):
+        """Return hit/miss counters and the number of cached answers per company"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = {company: len(entries) for company, entries in self._companies.items()}
+        return stats
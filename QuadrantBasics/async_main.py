@@ -0,0 +1,253 @@
+import asyncio
+import os
+import threading
+import time
+
+from qdrant_client import models
+
+import context_assembly
+import generation
+import main
+import provisioning
+import tracing
+
+# Number of upserts allowed in flight while the next batch is being embedded
+ingest_max_pending_upserts = main.ingest_max_pending_upserts
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def get_event_loop():
+    """Return the shared event loop, starting it on a daemon thread the first time"""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="async-main-loop", daemon=True).start()
+    return _loop
+
+
+def submit(coro):
+    """Schedule a coroutine on the shared loop from any thread and return its concurrent future"""
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop())
+
+
+def run(coro, timeout=None):
+    """Run a coroutine on the shared loop and block the calling thread until it finishes"""
+    return submit(coro).result(timeout)
+
+
+def get_async_client():
+    """Return the process wide AsyncQdrantClient; it must only be awaited on the shared loop"""
+    return main.connections.async_client
+
+
+def aretry(fn):
+    # Retry transient Qdrant failures the same way the sync client does
+    return main.connections.awith_retry(fn)
+
+
+async def acreate_qdrant_database(company_name):
+    # Vector store construction only happens once per company, so it can run on a worker thread
+    return await asyncio.to_thread(main.create_qdrant_database, company_name)
+
+
+async def adocument_exists(company, file_hash):
+    # The manifest lives on disk, so read it off the event loop
+    if await asyncio.to_thread(main.file_manifest.get, company, file_hash):
+        return True
+
+    points = await aretry(lambda: get_async_client().retrieve(
+        collection_name=main.collection_for_company(company),
+        ids=[main.point_id(company, file_hash, 0)],
+        with_payload=["ingest_complete"],
+        with_vectors=False,
+    ))
+    if points and main.is_complete(points[0].payload, file_hash):
+        return True
+
+    # Versions written by main.update_file mark whichever of their points they kept or added
+    marked, _ = await aretry(lambda: get_async_client().scroll(
+        collection_name=main.collection_for_company(company),
+        scroll_filter=main.completion_filter(company, file_hash),
+        limit=1,
+        with_payload=False,
+        with_vectors=False,
+    ))
+    return bool(marked)
+
+
+async def aadd_documents_to_vector_db(db, file_path, company, batch_size=None, progress_callback=None):
+    batch_size = batch_size or main.ingest_batch_size
+
+    # Calculate the file name from the path
+    file_name = os.path.basename(file_path)
+
+    # Hash the content and check for it before any parsing or embedding happens
+    file_hash = await asyncio.to_thread(main.hash_file, file_path)
+
+    with tracing.trace_request("ingest", company, file_name=file_name):
+        if await adocument_exists(company, file_hash):
+            return "Doc Already Exists"
+
+        # A new version of a stored file goes through main.py's page by page update
+        stored = await asyncio.to_thread(main.stored_pages, company, file_name)
+        if stored:
+            return await asyncio.to_thread(main.update_file, file_path, file_name, file_hash,
+                                           os.path.getsize(file_path), company, stored, batch_size, progress_callback)
+        return await aingest_new_file(file_path, file_name, file_hash, company, batch_size, progress_callback)
+
+
+async def aingest_new_file(file_path, file_name, file_hash, company, batch_size, progress_callback=None):
+    client = get_async_client()
+    hybrid = await asyncio.to_thread(main.is_hybrid, company)
+    started = time.perf_counter()
+    collection_name = main.collection_for_company(company)
+    total_chunks = 0
+    skipped_chunks = 0
+    pending_upserts = []
+
+    # PDF parsing is blocking, so pull each batch of chunks on a worker thread
+    batches = main.iter_batches(main.iter_chunks(file_path, file_name, company), batch_size)
+    batch_number = 0
+    try:
+        while (chunked_docs := await asyncio.to_thread(next, batches, None)) is not None:
+            batch_number += 1
+            batch_started = time.perf_counter()
+            ids = main.assign_point_ids(company, file_hash, chunked_docs)
+
+            # Skip chunks a previous, interrupted run already stored with the same text
+            stored = await aretry(lambda: client.retrieve(
+                collection_name=collection_name, ids=ids, with_payload=["metadata"], with_vectors=False
+            ))
+            new_chunks = main.unstored_chunks(ids, chunked_docs, stored)
+            skipped_chunks += len(chunked_docs) - len(new_chunks)
+
+            # Generate embeddings for this batch only
+            embedded_docs = await main.embeddings.aembed_documents(
+                [str(doc.page_content) for _, doc in new_chunks]
+            ) if new_chunks else []
+            points = main.build_points(new_chunks, embedded_docs, hybrid=hybrid)
+
+            # Wait for the oldest upsert before queueing another so memory stays bounded
+            while len(pending_upserts) >= ingest_max_pending_upserts:
+                await pending_upserts.pop(0)
+
+            # Upsert in the background while the next batch is parsed and embedded
+            if points:
+                pending_upserts.append(asyncio.ensure_future(
+                    aretry(lambda points=points: client.upsert(collection_name=collection_name, points=points))
+                ))
+
+            total_chunks += len(chunked_docs)
+            main.report_batch_progress(file_name, batch_number, chunked_docs, total_chunks, skipped_chunks,
+                                       time.perf_counter() - batch_started, progress_callback)
+    finally:
+        # Make sure every batch has landed (or failed) before returning
+        results = await asyncio.gather(*pending_upserts, return_exceptions=True)
+
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+
+    # Mark the file as fully ingested so later uploads of the same content are skipped
+    if total_chunks:
+        await aretry(lambda: client.set_payload(**main.completion_marker(company, file_hash)))
+
+    # Remember the file locally so the sidebar and dedup checks don't need Qdrant
+    await asyncio.to_thread(main.file_manifest.record, company, file_hash, file_name, total_chunks,
+                            os.path.getsize(file_path))
+
+    # Answers and statistics from before this file existed are now out of date
+    main.answer_cache.invalidate(company)
+    main.invalidate_stats(company)
+
+    elapsed = time.perf_counter() - started
+    print(f"[{file_name}] ingested {total_chunks} chunks ({skipped_chunks} already stored) in {elapsed:.2f}s "
+          f"({total_chunks / elapsed if elapsed else 0.0:.1f} chunks/s)")
+    return "Docs added to db"
+
+
+async def aretrieve_doc_by_metadata(company, file_name):
+    return await aretry(lambda: get_async_client().scroll(
+        collection_name=main.collection_for_company(company),
+        scroll_filter=models.Filter(
+            must=[
+                *main.company_filter(company).must,
+                models.FieldCondition(
+                    key="metadata.file_name",
+                    match=models.MatchValue(value=file_name),
+                ),
+            ]
+        ),
+    ))
+
+
+async def aretrieve_docs(db, query, company, k=4, query_vector=None, with_vectors=False):
+    # Get embeddings for the query unless the caller already has them
+    if query_vector is None:
+        with tracing.span("embed_query", company):
+            query_vector = await main.embeddings.aembed_query(query)
+
+    search_filter = main.company_filter(company)
+    # is_hybrid asks Qdrant synchronously the first time a company is seen
+    hybrid = await asyncio.to_thread(main.is_hybrid, company)
+    with tracing.span("qdrant_search", company):
+        if hybrid:
+            # Dense and keyword candidates are fused server side in a single round trip
+            response = await aretry(lambda: get_async_client().query_points(
+                **main.hybrid_query(main.collection_for_company(company), query, query_vector, search_filter, k),
+                with_vectors=with_vectors
+            ))
+        else:
+            # Search with metadata filter
+            response = await aretry(lambda: get_async_client().query_points(
+                collection_name=main.collection_for_company(company),
+                query=query_vector,
+                query_filter=search_filter,
+                search_params=provisioning.search_params(),
+                with_payload=True,
+                with_vectors=with_vectors,
+                limit=k
+            ))
+    results = response.points
+
+    return main.results_to_documents(results, with_vectors)
+
+
+async def aretrieve_context_docs(db, query, company, k=4, query_vector=None):
+    if query_vector is None:
+        with tracing.span("embed_query", company):
+            query_vector = await main.embeddings.aembed_query(query)
+    candidates = await aretrieve_docs(db, query, company, k=k * context_assembly.mmr_candidates_per_result,
+                                      query_vector=query_vector, with_vectors=True)
+    with tracing.span("mmr", company):
+        return [(doc, score) for doc, score, _ in context_assembly.select_mmr(candidates, k, query_vector)]
+
+
+async def aquestion_pdf(question, documents, priority=generation.INTERACTIVE):
+    chain_input = main.build_chain_input(question, documents)
+    # Shares main.py's generation slots and queue, so async callers can't flood Ollama past the cap; the
+    # wait happens on the event loop, so queued questions don't tie up the threads to_thread relies on
+    return await main.generation_manager.ainvoke(chain_input, priority)
+
+
+async def aanswer_question(db, question, company, k=4, priority=generation.INTERACTIVE):
+    with tracing.trace_request("answer_question", company):
+        # Embed the question once and reuse it for both the cache lookup and the search
+        with tracing.span("embed_query", company):
+            query_vector = await main.embeddings.aembed_query(question)
+
+        with tracing.span("answer_cache", company):
+            cached = main.answer_cache.lookup(company, query_vector)
+        if cached:
+            return cached["answer"], cached["documents"], True
+
+        related_documents = await aretrieve_context_docs(db, question, company, k=k, query_vector=query_vector)
+        if not related_documents:
+            return None, related_documents, False
+
+        answer = await aquestion_pdf(question, related_documents, priority=priority)
+        main.answer_cache.store(company, question, query_vector, answer, related_documents)
+        return answer, related_documents, False
@@ -0,0 +1,260 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+from qdrant_client import QdrantClient
+
+import main
+from embedding_backends import HashingBackend
+from embedding_cache import CachedEmbeddings
+from fakes import FakeLLM, make_pdf, random_sentence
+from manifest import FileManifest
+from metrics import percentile
+from qdrant_connections import VectorStoreRegistry
+
+COMPANY = "Benchmark Co"
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def latency_summary(samples):
+    return {
+        "count": len(samples),
+        "mean": sum(samples) / len(samples) if samples else 0.0,
+        "p50": percentile(samples, 0.50),
+        "p95": percentile(samples, 0.95),
+        "p99": percentile(samples, 0.99),
+    }
+
+
+def bench_startup(repeats=3):
+    """Seconds a fresh interpreter takes to import main.py, the floor for every entry point's start up"""
+    samples = []
+    for _ in range(repeats):
+        output = subprocess.check_output(
+            [sys.executable, "-c", "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+        samples.append(float(output.decode().strip().splitlines()[-1]))
+    return {"import_main_seconds": min(samples)}
+
+
+def configure_offline(work_dir, args):
+    """Point main.py at an in-memory (or local path) Qdrant, a hashing embedder and a fake LLM"""
+    # Local Qdrant ignores payload indexes and HNSW search params and warns about both on every call
+    warnings.filterwarnings("ignore", message="Payload indexes have no effect")
+    warnings.filterwarnings("ignore", message="Local mode performs exact")
+    client = QdrantClient(path=args.qdrant_path) if args.qdrant_path else QdrantClient(":memory:")
+    main.connections.use_client(client)
+    main.database_list = VectorStoreRegistry()
+    main.hybrid_collections.clear()
+    main.file_manifest = FileManifest(directory=os.path.join(work_dir, "manifests"))
+
+    main.embedding_backend = HashingBackend(
+        dimension=args.dimension,
+        batch_size=args.embed_batch_size,
+        latency_seconds=args.embed_latency,
+    )
+    main.embedding_model_name = main.embedding_backend.model_id
+    main.embeddings = CachedEmbeddings(
+        main.embedding_backend,
+        model_name=main.embedding_model_name,
+        path=os.path.join(work_dir, "embedding_cache.sqlite3"),
+    )
+    main.query_batch_window_seconds = args.query_batch_window
+    main.query_batcher.window_seconds = args.query_batch_window
+    main.model = FakeLLM(latency_seconds=args.llm_latency, token_latency_seconds=args.llm_token_latency)
+
+    # Import the lazily loaded libraries now so the first measured query doesn't pay for them
+    with quiet(not args.verbose):
+        main.preload()
+
+
+def quiet(enabled):
+    # main.py prints progress for every batch; keep benchmark output readable unless asked
+    return contextlib.redirect_stdout(io.StringIO()) if enabled else contextlib.nullcontext()
+
+
+def bench_ingest(db, pdf_path, args):
+    tracemalloc.start()
+    started = time.perf_counter()
+    with quiet(not args.verbose):
+        result = main.add_documents_to_vector_db(db, pdf_path, COMPANY, batch_size=args.ingest_batch_size)
+    seconds = time.perf_counter() - started
+    # What is still allocated afterwards is mostly the in-memory Qdrant holding the new points; the rest of
+    # the peak is what parsing, embedding and upserting needed on the way
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    entry = main.file_manifest.get(COMPANY, main.hash_file(pdf_path)) or {}
+    chunks = entry.get("chunk_count", 0)
+    return {
+        "result": result,
+        "seconds": seconds,
+        "chunks": chunks,
+        "chunks_per_second": chunks / seconds if seconds else 0.0,
+        "peak_memory_bytes": peak,
+        "retained_memory_bytes": current,
+        "pipeline_memory_bytes": peak - current,
+    }
+
+
+def bench_queries(db, args, rng):
+    retrieve_samples = []
+    question_samples = []
+    for _ in range(args.queries):
+        # Fresh questions every time so the embedding cache doesn't flatter the numbers
+        question = random_sentence(rng, words=8)
+
+        started = time.perf_counter()
+        documents = main.retrieve_docs(db, question, COMPANY, k=args.k)
+        retrieve_samples.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        with quiet(not args.verbose):
+            main.question_pdf(question, documents)
+        question_samples.append(time.perf_counter() - started)
+
+    return {
+        "retrieve_docs": latency_summary(retrieve_samples),
+        "question_pdf": latency_summary(question_samples),
+    }
+
+
+def bench_concurrent_queries(db, args, rng):
+    """Retrieval latency and throughput with many questions in flight, where query batching pays off"""
+    questions = [random_sentence(rng, words=8) for _ in range(args.queries)]
+
+    def timed_retrieve(question):
+        started = time.perf_counter()
+        main.retrieve_docs(db, question, COMPANY, k=args.k)
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        samples = list(pool.map(timed_retrieve, questions))
+    seconds = time.perf_counter() - started
+    return {**latency_summary(samples), "queries_per_second": len(samples) / seconds if seconds else 0.0}
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    results = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "started_at": time.time(),
+        "settings": vars(args),
+        "steps": [],
+    }
+
+    results["startup"] = bench_startup()
+    print(f"import main: {results['startup']['import_main_seconds'] * 1000:.0f} ms")
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        configure_offline(work_dir, args)
+        with quiet(not args.verbose):
+            db = main.create_qdrant_database(COMPANY, hybrid=args.hybrid)
+
+        # Each PDF is added to the same collection, so query latency is measured as it grows
+        for pages in args.pages:
+            pdf_path = make_pdf(os.path.join(work_dir, f"generated_{pages}_pages.pdf"), pages, seed=args.seed)
+            step = {"pages": pages, "pdf_bytes": os.path.getsize(pdf_path)}
+            step["ingest"] = bench_ingest(db, pdf_path, args)
+            step["collection_chunks"] = main.collection_stats(COMPANY)["chunks"]
+            step.update(bench_queries(db, args, rng))
+            if args.concurrency > 1:
+                step["concurrent_retrieve"] = bench_concurrent_queries(db, args, rng)
+            results["steps"].append(step)
+
+            print(f"{pages:>5} pages: ingest {step['ingest']['seconds']:.2f}s "
+                  f"({step['ingest']['chunks_per_second']:.0f} chunks/s, "
+                  f"pipeline {step['ingest']['pipeline_memory_bytes'] / 1e6:.1f} MB, "
+                  f"retained {step['ingest']['retained_memory_bytes'] / 1e6:.1f} MB), "
+                  f"collection {step['collection_chunks']} chunks, "
+                  f"retrieve p50/p95/p99 {step['retrieve_docs']['p50'] * 1000:.1f}/"
+                  f"{step['retrieve_docs']['p95'] * 1000:.1f}/{step['retrieve_docs']['p99'] * 1000:.1f} ms, "
+                  f"question p50 {step['question_pdf']['p50'] * 1000:.1f} ms")
+            if "concurrent_retrieve" in step:
+                print(f"{'':>5} {args.concurrency} concurrent: retrieve p50/p95 "
+                      f"{step['concurrent_retrieve']['p50'] * 1000:.1f}/{step['concurrent_retrieve']['p95'] * 1000:.1f} ms, "
+                      f"{step['concurrent_retrieve']['queries_per_second']:.0f} queries/s")
+
+    main.connections.close()
+    return results
+
+
+def compare(baseline, current):
+    """Print the relative change of the headline numbers against an earlier results file"""
+    print(f"\nCompared with {baseline.get('commit') or 'baseline'}:")
+    if "startup" in baseline:
+        old, new = baseline["startup"]["import_main_seconds"], current["startup"]["import_main_seconds"]
+        print(f"  {'import main s':>28}: {old:10.2f} -> {new:10.2f} ({(new - old) / old * 100 if old else 0.0:+.1f}%)")
+    previous = {step["pages"]: step for step in baseline["steps"]}
+    for step in current["steps"]:
+        before = previous.get(step["pages"])
+        if not before:
+            continue
+        for label, old, new in [
+            ("ingest s", before["ingest"]["seconds"], step["ingest"]["seconds"]),
+            ("peak MB", before["ingest"]["peak_memory_bytes"] / 1e6, step["ingest"]["peak_memory_bytes"] / 1e6),
+            # Results from before pipeline memory was split out fall back to their peak
+            ("pipeline MB", before["ingest"].get("pipeline_memory_bytes", before["ingest"]["peak_memory_bytes"]) / 1e6,
+             step["ingest"]["pipeline_memory_bytes"] / 1e6),
+            ("retrieve p95 ms", before["retrieve_docs"]["p95"] * 1000, step["retrieve_docs"]["p95"] * 1000),
+            ("question p95 ms", before["question_pdf"]["p95"] * 1000, step["question_pdf"]["p95"] * 1000),
+        ]:
+            change = (new - old) / old * 100 if old else 0.0
+            print(f"  {step['pages']:>5} pages {label:>16}: {old:10.2f} -> {new:10.2f} ({change:+.1f}%)")
+
+
+def cli():
+    parser = argparse.ArgumentParser(description="Offline ingest and query benchmark using in-memory Qdrant")
+    parser.add_argument("--pages", type=int, nargs="+", default=[10, 50, 200], help="Sizes of the generated PDFs")
+    parser.add_argument("--queries", type=int, default=50, help="Queries measured after each ingest")
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="Also measure retrieval with this many questions in flight at once")
+    parser.add_argument("--query-batch-window", type=float, default=main.query_batch_window_seconds,
+                        help="Seconds main.py waits to batch concurrent questions (0 disables batching)")
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="Seconds of fake latency per embedding batch")
+    parser.add_argument("--embed-batch-size", type=int, default=64)
+    parser.add_argument("--ingest-batch-size", type=int, default=main.ingest_batch_size)
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Seconds before the fake LLM answers")
+    parser.add_argument("--llm-token-latency", type=float, default=0.0, help="Seconds per generated token")
+    parser.add_argument("--hybrid", action="store_true", help="Benchmark a hybrid sparse+dense collection")
+    parser.add_argument("--qdrant-path", help="Use a local on-disk Qdrant at this path instead of :memory:")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark_results.json", help="Where to write the JSON results")
+    parser.add_argument("--compare", help="Earlier results file to compare against")
+    parser.add_argument("--verbose", action="store_true", help="Show main.py's own progress output")
+    args = parser.parse_args()
+
+    results = run(args)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            compare(json.load(f), results)
+
+
+if __name__ == "__main__":
+    cli()
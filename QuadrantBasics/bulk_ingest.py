@@ -0,0 +1,279 @@
+import argparse
+import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+import main
+import tracing
+from manifest import company_slug
+
+
+def find_pdfs(directory):
+    """Return every PDF below a directory, in a stable order"""
+    paths = []
+    for root, _, files in os.walk(directory):
+        paths.extend(os.path.join(root, name) for name in files if name.lower().endswith(".pdf"))
+    return sorted(paths)
+
+
+def read_file_list(path):
+    """Read one PDF path per line, ignoring blank lines and # comments"""
+    with open(path, "r") as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+
+def parse_pdf(file_path, company):
+    """Load and chunk one PDF; runs in a worker process"""
+    return list(main.iter_chunks(file_path, os.path.basename(file_path), company))
+
+
+class Checkpoint:
+    """Append-only JSON lines record of finished and failed files so an interrupted run can pick up where it stopped"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.completed = {}
+        self.failed = {}
+        try:
+            with open(path, "r") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # a line cut short when the previous run was killed
+                    if "file_hash" in entry:
+                        self.completed[entry["file_path"]] = entry["file_hash"]
+                        self.failed.pop(entry["file_path"], None)
+                    else:
+                        self.failed[entry["file_path"]] = entry["error"]
+        except FileNotFoundError:
+            pass
+        self._file = None
+
+    def is_done(self, file_path, file_hash):
+        return self.completed.get(file_path) == file_hash
+
+    def _append(self, entry):
+        # One short line per file instead of rewriting the whole record, so the cost stays flat on large runs
+        if self._file is None:
+            self._file = open(self.path, "a+")
+            # Start on a fresh line if the previous run was killed halfway through writing one
+            if self._file.tell():
+                self._file.seek(self._file.tell() - 1)
+                if self._file.read(1) != "\n":
+                    self._file.write("\n")
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+
+    def mark_done(self, file_path, file_hash):
+        with self._lock:
+            self.completed[file_path] = file_hash
+            self.failed.pop(file_path, None)
+            self._append({"file_path": file_path, "file_hash": file_hash})
+
+    def mark_failed(self, file_path, error):
+        with self._lock:
+            self.failed[file_path] = error
+            self._append({"file_path": file_path, "error": error})
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class BulkIngest:
+    """Parses PDFs in a process pool, embeds chunks from many files together and upserts in parallel"""
+
+    def __init__(self, company, checkpoint, parse_workers=4, embed_batch_size=64, upsert_workers=4):
+        self.company = company
+        self.checkpoint = checkpoint
+        self.parse_workers = parse_workers
+        self.embed_batch_size = embed_batch_size
+        self.upsert_workers = upsert_workers
+
+        self.files = {}
+        self.stats = {"files_done": 0, "files_skipped": 0, "files_failed": 0, "chunks": 0, "chunks_skipped": 0}
+
+    def fail(self, file_path, error):
+        print(f"Failed to ingest {file_path}: {str(error)}")
+        self.files.pop(file_path, None)
+        self.stats["files_failed"] += 1
+        self.checkpoint.mark_failed(file_path, str(error))
+
+    def finish(self, file_path):
+        # Every chunk of the file has landed, so flag it complete everywhere
+        info = self.files.pop(file_path)
+        if info["chunks"]:
+            main.qdrant_client.set_payload(**main.completion_marker(self.company, info["file_hash"]))
+        main.file_manifest.record(self.company, info["file_hash"], os.path.basename(file_path), info["chunks"],
+                                  info["bytes"])
+        self.checkpoint.mark_done(file_path, info["file_hash"])
+        self.stats["files_done"] += 1
+
+    def embed_and_submit(self, batch, upsert_pool, pending_upserts):
+        ids = [point for _, point, _ in batch]
+        docs = [doc for _, _, doc in batch]
+
+        # Chunks stored by an earlier, interrupted run are not embedded again
+        with tracing.span("qdrant_retrieve", self.company):
+            stored = main.qdrant_client.retrieve(collection_name=main.collection_for_company(self.company), ids=ids,
+                                                 with_payload=["metadata"], with_vectors=False)
+        new_chunks = main.unstored_chunks(ids, docs, stored)
+        self.stats["chunks_skipped"] += len(batch) - len(new_chunks)
+
+        with tracing.span("embed_documents", self.company):
+            embedded_docs = main.embeddings.embed_documents([doc.page_content for _, doc in new_chunks]) if new_chunks else []
+        points = main.build_points(new_chunks, embedded_docs, hybrid=main.is_hybrid(self.company))
+
+        counts = {}
+        for file_path, _, _ in batch:
+            counts[file_path] = counts.get(file_path, 0) + 1
+        future = upsert_pool.submit(main.upsert_points, self.company, points) if points else None
+        pending_upserts.append((future, counts))
+
+    def reap(self, pending_upserts, keep):
+        # Wait for upserts until at most `keep` are outstanding, then finish any file whose chunks all landed
+        while len(pending_upserts) > keep:
+            future, counts = pending_upserts.pop(0)
+            try:
+                if future is not None:
+                    future.result()
+            except Exception as e:
+                for file_path in counts:
+                    if file_path in self.files:
+                        self.fail(file_path, e)
+                continue
+            for file_path, count in counts.items():
+                if file_path in self.files:
+                    self.files[file_path]["remaining"] -= count
+                    self.stats["chunks"] += count
+                    if self.files[file_path]["remaining"] == 0:
+                        self.finish(file_path)
+
+    def run(self, paths):
+        started = time.perf_counter()
+        main.create_qdrant_database(self.company)
+
+        paths = iter(paths)
+        pending_parses = {}
+        pending_upserts = []
+        buffer = []
+
+        # Spawned, not forked: the Qdrant gRPC channel opened above must not be copied into the workers
+        spawn = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=self.parse_workers, mp_context=spawn) as parse_pool, \
+                ThreadPoolExecutor(max_workers=self.upsert_workers) as upsert_pool:
+
+            def fill():
+                # Keep the parse pool busy without queueing the whole directory at once
+                while len(pending_parses) < self.parse_workers * 2:
+                    file_path = next(paths, None)
+                    if file_path is None:
+                        return
+                    try:
+                        file_hash = main.hash_file(file_path)
+                        if self.checkpoint.is_done(file_path, file_hash) or main.document_exists(self.company, file_hash):
+                            self.stats["files_skipped"] += 1
+                            continue
+                        size = os.path.getsize(file_path)
+                    except Exception as e:
+                        self.fail(file_path, e)
+                        continue
+                    future = parse_pool.submit(parse_pdf, file_path, self.company)
+                    pending_parses[future] = (file_path, file_hash, size)
+
+            fill()
+            while pending_parses:
+                done, _ = wait(pending_parses, return_when=FIRST_COMPLETED)
+                for future in done:
+                    file_path, file_hash, size = pending_parses.pop(future)
+                    try:
+                        chunks = future.result()
+                    except Exception as e:
+                        self.fail(file_path, e)
+                        continue
+
+                    self.files[file_path] = {"file_hash": file_hash, "bytes": size, "chunks": len(chunks),
+                                             "remaining": len(chunks)}
+                    if not chunks:
+                        self.finish(file_path)
+                        continue
+                    ids = main.assign_point_ids(self.company, file_hash, chunks)
+                    buffer.extend((file_path, ids[i], chunks[i]) for i in range(len(chunks)))
+
+                # Embed full batches drawn from whichever files have been parsed so far
+                while len(buffer) >= self.embed_batch_size:
+                    batch, buffer = buffer[:self.embed_batch_size], buffer[self.embed_batch_size:]
+                    self.run_batch(batch, upsert_pool, pending_upserts)
+                fill()
+
+            if buffer:
+                self.run_batch(buffer, upsert_pool, pending_upserts)
+            self.reap(pending_upserts, 0)
+
+        main.answer_cache.invalidate(self.company)
+        main.invalidate_stats(self.company)
+        self.stats["seconds"] = time.perf_counter() - started
+        return self.stats
+
+    def run_batch(self, batch, upsert_pool, pending_upserts):
+        # Files already marked failed (e.g. an earlier upsert error) are dropped from the batch
+        batch = [item for item in batch if item[0] in self.files]
+        if not batch:
+            return
+        try:
+            self.embed_and_submit(batch, upsert_pool, pending_upserts)
+        except Exception as e:
+            for file_path in {item[0] for item in batch}:
+                if file_path in self.files:
+                    self.fail(file_path, e)
+            return
+        self.reap(pending_upserts, self.upsert_workers * 2)
+
+
+def cli():
+    parser = argparse.ArgumentParser(description="Bulk ingest a directory (or list) of PDFs into a company collection")
+    parser.add_argument("company", help="Company whose collection the PDFs are added to")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--dir", help="Directory searched recursively for PDFs")
+    source.add_argument("--file-list", help="Text file with one PDF path per line")
+    parser.add_argument("--parse-workers", type=int, default=os.cpu_count() or 4)
+    parser.add_argument("--embed-batch-size", type=int, default=64)
+    parser.add_argument("--upsert-workers", type=int, default=4)
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: .bulk_ingest_<company>.jsonl)")
+    args = parser.parse_args()
+    tracing.start_exporters()
+
+    paths = find_pdfs(args.dir) if args.dir else read_file_list(args.file_list)
+    checkpoint = Checkpoint(args.checkpoint or f".bulk_ingest_{company_slug(args.company)}.jsonl")
+    print(f"Ingesting {len(paths)} PDFs into {args.company} ({len(checkpoint.completed)} already done)")
+
+    stats = BulkIngest(
+        args.company,
+        checkpoint,
+        parse_workers=args.parse_workers,
+        embed_batch_size=args.embed_batch_size,
+        upsert_workers=args.upsert_workers,
+    ).run(paths)
+    checkpoint.close()
+
+    seconds = stats["seconds"] or 1e-9
+    print("\n=== Bulk ingest finished ===")
+    print(f"Files ingested: {stats['files_done']} ({stats['files_done'] / seconds:.2f} files/s)")
+    print(f"Chunks processed: {stats['chunks']} ({stats['chunks'] / seconds:.1f} chunks/s), "
+          f"{stats['chunks_skipped']} of them already stored")
+    print(f"Files skipped (already ingested): {stats['files_skipped']}")
+    print(f"Files failed: {stats['files_failed']}")
+    for file_path, error in checkpoint.failed.items():
+        print(f"  {file_path}: {error}")
+    print(f"Elapsed: {stats['seconds']:.1f}s")
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,355 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import main
+import provisioning
+from manifest import company_slug
+
+# An export is a directory holding:
+#   vectors.bin      the dense vectors as one contiguous little-endian float32/float16 array, row i = point i
+#   payloads.parquet the payload columns (id, text, metadata, other) in the same row order (payloads.jsonl
+#                    when exported with --payload-format jsonl)
+#   manifest.json    shape, dtype, checksums and collection settings; written last, so its presence means
+#                    the export finished
+vector_file = "vectors.bin"
+manifest_file = "manifest.json"
+payload_files = {"parquet": "payloads.parquet", "jsonl": "payloads.jsonl"}
+dtypes = {"float32": "<f4", "float16": "<f2"}
+
+
+def file_sha256(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(block_size):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def payload_row(point):
+    """Split a point's payload into the archive's columns"""
+    payload = dict(point.payload or {})
+    text = payload.pop("text", "")
+    metadata = payload.pop("metadata", {})
+    return {
+        "id": str(point.id),
+        "text": text,
+        "metadata": json.dumps(metadata),
+        "other": json.dumps(payload),
+    }
+
+
+class ParquetPayloadWriter:
+    """Write payload rows as one parquet row group per scrolled page"""
+
+    def __init__(self, path):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError("Parquet payloads need `pip install pyarrow`, or pass --payload-format jsonl") from e
+        self.pa = pa
+        self.schema = pa.schema([("id", pa.string()), ("text", pa.string()),
+                                 ("metadata", pa.string()), ("other", pa.string())])
+        self.writer = pq.ParquetWriter(path, self.schema, compression="zstd")
+
+    def write(self, rows):
+        self.writer.write_table(self.pa.Table.from_pylist(rows, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+class JsonlPayloadWriter:
+    def __init__(self, path):
+        self.f = open(path, "w")
+
+    def write(self, rows):
+        self.f.writelines(json.dumps(row) + "\n" for row in rows)
+
+    def close(self):
+        self.f.close()
+
+
+def iter_payload_rows(path, payload_format, batch_size):
+    """Yield lists of payload rows in file order"""
+    if payload_format == "parquet":
+        try:
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError("Reading parquet payloads needs `pip install pyarrow`") from e
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size):
+            yield batch.to_pylist()
+        return
+
+    rows = []
+    with open(path, "r") as f:
+        for line in f:
+            rows.append(json.loads(line))
+            if len(rows) >= batch_size:
+                yield rows
+                rows = []
+    if rows:
+        yield rows
+
+
+def export_company(client, company, out_dir, dtype="float32", payload_format="parquet", batch_size=1024):
+    """Stream a company's points into out_dir without holding more than one page in memory"""
+    collection_name = main.collection_for_company(company)
+    os.makedirs(out_dir, exist_ok=True)
+    # A stale manifest would make a half written export look finished
+    if os.path.exists(os.path.join(out_dir, manifest_file)):
+        os.remove(os.path.join(out_dir, manifest_file))
+
+    started = time.perf_counter()
+    vectors_path = os.path.join(out_dir, vector_file)
+    payloads_path = os.path.join(out_dir, payload_files[payload_format])
+    payload_writer = ParquetPayloadWriter(payloads_path) if payload_format == "parquet" else JsonlPayloadWriter(payloads_path)
+    vector_digest = hashlib.sha256()
+    count = 0
+    dimension = None
+    embedding_model = None
+    offset = None
+
+    try:
+        with open(vectors_path, "wb") as vectors_out:
+            while True:
+                points, offset = client.scroll(
+                    collection_name=collection_name,
+                    scroll_filter=main.company_filter(company),
+                    limit=batch_size,
+                    offset=offset,
+                    with_payload=True,
+                    with_vectors=[""],
+                )
+                if points:
+                    # Only the dense vector is exported; sparse vectors are rebuilt from the text on import
+                    block = np.asarray([p.vector[""] if isinstance(p.vector, dict) else p.vector for p in points],
+                                       dtype=dtypes[dtype])
+                    dimension = block.shape[1]
+                    data = block.tobytes()
+                    vectors_out.write(data)
+                    vector_digest.update(data)
+                    payload_writer.write([payload_row(p) for p in points])
+                    embedding_model = embedding_model or (points[0].payload.get("metadata") or {}).get("embedding_model")
+                    count += len(points)
+                    print(f"[{company}] exported {count} points")
+                if offset is None:
+                    break
+    finally:
+        payload_writer.close()
+
+    manifest = {
+        "company": company,
+        "source_collection": collection_name,
+        "count": count,
+        "dimension": dimension,
+        "dtype": dtype,
+        "payload_format": payload_format,
+        "hybrid": provisioning.has_sparse_vector(client, collection_name),
+        "embedding_model": embedding_model,
+        "distance": provisioning.distance,
+        "files": main.file_manifest.files(company),
+        "checksums": {
+            vector_file: vector_digest.hexdigest(),
+            payload_files[payload_format]: file_sha256(payloads_path),
+        },
+        "exported_at": time.time(),
+    }
+    with open(os.path.join(out_dir, manifest_file + ".tmp"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(os.path.join(out_dir, manifest_file + ".tmp"), os.path.join(out_dir, manifest_file))
+
+    seconds = time.perf_counter() - started
+    size = os.path.getsize(vectors_path) + os.path.getsize(payloads_path)
+    print(f"[{company}] exported {count} points ({size / 1e6:.1f} MB) to {out_dir} in {seconds:.1f}s")
+    return manifest
+
+
+def read_manifest(export_dir):
+    try:
+        with open(os.path.join(export_dir, manifest_file), "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise ValueError(f"{export_dir} has no {manifest_file}; the export is missing or didn't finish")
+
+
+def verify_export(export_dir, manifest):
+    """Raise if any file differs from the checksum recorded at export time"""
+    for name, expected in manifest["checksums"].items():
+        if file_sha256(os.path.join(export_dir, name)) != expected:
+            raise ValueError(f"Checksum mismatch for {name} in {export_dir}; the export is corrupt or incomplete")
+
+
+def open_vectors(export_dir, manifest):
+    """Memory-map the exported vectors; rows are only read from disk as they are uploaded"""
+    if not manifest["count"]:
+        return np.zeros((0, manifest["dimension"] or 0), dtype=dtypes[manifest["dtype"]])
+    return np.memmap(os.path.join(export_dir, vector_file), dtype=dtypes[manifest["dtype"]], mode="r",
+                     shape=(manifest["count"], manifest["dimension"]))
+
+
+def to_point(row, vector, hybrid, company, renamed=False):
+    from qdrant_client import models
+
+    point_id = int(row["id"]) if row["id"].isdigit() else row["id"]
+    # Filters match on metadata.company, so points always carry the company they are imported into,
+    # the same way migrate_tenants stamps it
+    metadata = {**json.loads(row["metadata"]), "company": company}
+    if renamed and metadata.get("file_hash") and metadata.get("chunk_index") is not None:
+        # Point IDs are derived from the company too; keeping the source's would collide with its own chunks
+        point_id = main.point_id(company, metadata["file_hash"], metadata["chunk_index"])
+    payload = {"text": row["text"], "metadata": metadata, **json.loads(row["other"])}
+    # The lexical vector is cheap to rebuild from the stored text; the dense one is never re-embedded
+    return models.PointStruct(id=point_id, vector=main.point_vector(row["text"], vector.tolist(), hybrid),
+                              payload=payload)
+
+
+class ImportProgress:
+    """Rows of an export already uploaded to a collection, so an interrupted import resumes where it stopped"""
+
+    def __init__(self, path, export_checksum):
+        self.path = path
+        self.export_checksum = export_checksum
+        try:
+            with open(path, "r") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            state = {}
+        # Progress made against a different export doesn't count
+        self.rows_done = state.get("rows_done", 0) if state.get("export_checksum") == export_checksum else 0
+
+    def save(self, rows_done):
+        self.rows_done = rows_done
+        with open(self.path + ".tmp", "w") as f:
+            json.dump({"export_checksum": self.export_checksum, "rows_done": rows_done}, f)
+        os.replace(self.path + ".tmp", self.path)
+
+    def finish(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def import_company(client, export_dir, company=None, hybrid=None, batch_size=256, parallel=4,
+                   checkpoint_rows=8192, progress_path=None):
+    """Upload an export into a company's collection, creating it if needed; never calls the embedder"""
+    manifest = read_manifest(export_dir)
+    company = company or manifest["company"]
+    renamed = company != manifest["company"]
+    collection_name = main.collection_for_company(company)
+    hybrid = manifest["hybrid"] if hybrid is None else hybrid
+
+    if not manifest["count"]:
+        print(f"[{company}] the export holds no points")
+        return 0
+
+    started = time.perf_counter()
+    verify_export(export_dir, manifest)
+    print(f"[{company}] checksums verified in {time.perf_counter() - started:.1f}s")
+
+    created = provisioning.ensure_collection(client, collection_name, manifest["dimension"], hybrid=hybrid,
+                                             shared=main.collection_layout == "shared")
+    if created:
+        main.forget_collection_files(company)
+    elif manifest["embedding_model"]:
+        # Mixing vectors from two models in one collection would make every search meaningless
+        provisioning.check_embedding_model(client, collection_name, manifest["embedding_model"])
+    hybrid = provisioning.has_sparse_vector(client, collection_name)
+
+    progress = ImportProgress(progress_path or f".import_{company_slug(company)}.json",
+                              manifest["checksums"][vector_file])
+    if progress.rows_done:
+        print(f"[{company}] resuming after {progress.rows_done} of {manifest['count']} points")
+
+    vectors = open_vectors(export_dir, manifest)
+    payload_path = os.path.join(export_dir, payload_files[manifest["payload_format"]])
+
+    def upload(rows, first_row):
+        points = [to_point(row, vectors[first_row + i], hybrid, company, renamed) for i, row in enumerate(rows)]
+        # upload_points splits the window into batches and sends them over parallel connections
+        client.upload_points(collection_name=collection_name, points=points, batch_size=batch_size,
+                             parallel=parallel, wait=True)
+        return first_row + len(rows)
+
+    # Rows are uploaded in windows; progress is saved after each window lands, and the next window is
+    # read from disk while the previous one uploads
+    skip = progress.rows_done
+    rows_done = 0
+    window, window_start = [], skip
+    pending = None
+    with ThreadPoolExecutor(max_workers=1) as upload_pool:
+        for rows in iter_payload_rows(payload_path, manifest["payload_format"], batch_size):
+            first_row = rows_done
+            rows_done += len(rows)
+            if rows_done <= skip:
+                continue
+            window.extend(rows[max(0, skip - first_row):])
+            if len(window) >= checkpoint_rows or rows_done >= manifest["count"]:
+                if pending:
+                    progress.save(pending.result())
+                pending = upload_pool.submit(upload, window, window_start)
+                window_start += len(window)
+                window = []
+                print(f"[{company}] {rows_done}/{manifest['count']} points")
+        if window:
+            if pending:
+                progress.save(pending.result())
+            pending = upload_pool.submit(upload, window, window_start)
+        if pending:
+            progress.save(pending.result())
+
+    if rows_done != manifest["count"]:
+        raise ValueError(f"{payload_path} has {rows_done} rows but the manifest records {manifest['count']}")
+    progress.finish()
+
+    # Files, completion markers and all, are known again without re-ingesting anything
+    for entry in manifest["files"]:
+        main.file_manifest.record(company, entry["file_hash"], entry["file_name"], entry["chunk_count"], entry["bytes"])
+    main.file_manifest.touch(company)
+    main.answer_cache.invalidate(company)
+    main.invalidate_stats(company)
+
+    seconds = time.perf_counter() - started
+    print(f"[{company}] imported {manifest['count']} points into {collection_name} in {seconds:.1f}s "
+          f"({manifest['count'] / seconds if seconds else 0.0:.0f} points/s)")
+    return manifest["count"]
+
+
+def cli():
+    parser = argparse.ArgumentParser(description="Export a company's points to disk or import them back, "
+                                                 "without re-embedding")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("export", help="Write a company's points to a directory")
+    export_parser.add_argument("company")
+    export_parser.add_argument("out_dir")
+    export_parser.add_argument("--dtype", choices=sorted(dtypes), default="float32",
+                               help="float16 halves the vector file at a small cost in precision")
+    export_parser.add_argument("--payload-format", choices=sorted(payload_files), default="parquet")
+    export_parser.add_argument("--batch-size", type=int, default=1024)
+
+    import_parser = commands.add_parser("import", help="Upload an export into a company's collection")
+    import_parser.add_argument("export_dir")
+    import_parser.add_argument("--company", help="Company to import into (default: the exported company)")
+    import_parser.add_argument("--hybrid", action="store_true", default=None,
+                               help="Create the collection with sparse vectors even if the source had none")
+    import_parser.add_argument("--batch-size", type=int, default=256)
+    import_parser.add_argument("--parallel", type=int, default=4, help="Concurrent upload connections")
+    import_parser.add_argument("--progress-file", help="Resume file (default: .import_<company>.json)")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_company(main.qdrant_client, args.company, args.out_dir, dtype=args.dtype,
+                       payload_format=args.payload_format, batch_size=args.batch_size)
+    else:
+        import_company(main.qdrant_client, args.export_dir, company=args.company, hybrid=args.hybrid,
+                       batch_size=args.batch_size, parallel=args.parallel, progress_path=args.progress_file)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,138 @@
+from operator import mul
+
+from answer_cache import normalise_vector
+from metrics import metrics
+
+# Upper bound on the prompt context; generation time on CPU grows with prompt length
+context_token_budget = 1500
+
+# Rough characters per token for the models we run, used to estimate prompt size without a tokenizer
+chars_per_token = 4
+
+# MMR trade-off between relevance to the question (1.0) and novelty against chunks already picked (0.0)
+mmr_lambda = 0.7
+
+# Candidates fetched from Qdrant per chunk that ends up in the prompt, giving MMR something to choose from
+mmr_candidates_per_result = 3
+
+# Candidates more similar than this to an already picked chunk are dropped outright
+duplicate_similarity = 0.97
+
+# Budget left over smaller than this is not worth filling with a truncated chunk
+min_truncated_tokens = 100
+
+
+def estimate_tokens(text):
+    return (len(text) + chars_per_token - 1) // chars_per_token
+
+
+def select_mmr(candidates, k, query_vector=None):
+    """Pick k (doc, score, vector) candidates by maximal marginal relevance, dropping near-duplicates"""
+    vectors = [normalise_vector(vector) for _, _, vector in candidates]
+    # Hybrid scores are rank fusion values, not similarities, so relevance is measured against the query itself
+    if query_vector is not None:
+        query = normalise_vector(query_vector)
+        relevance = [sum(map(mul, query, vector)) for vector in vectors]
+    else:
+        relevance = [score for _, score, _ in candidates]
+    remaining = list(range(len(candidates)))
+    selected = []
+    while remaining and len(selected) < k:
+        best, best_value = None, None
+        for i in list(remaining):
+            redundancy = max((sum(map(mul, vectors[i], vectors[j])) for j in selected), default=0.0)
+            if redundancy >= duplicate_similarity:
+                remaining.remove(i)
+                continue
+            value = mmr_lambda * relevance[i] - (1 - mmr_lambda) * redundancy
+            if best_value is None or value > best_value:
+                best, best_value = i, value
+        if best is None:
+            break
+        selected.append(best)
+        remaining.remove(best)
+    return [candidates[i] for i in selected]
+
+
+def merge_overlapping(documents):
+    """Merge chunks from the same page whose stored offsets touch or overlap.
+
+    Returns (text, score) blocks ordered by the best score of the chunks they contain.
+    """
+    blocks = []
+    groups = {}
+    for doc, score in documents:
+        metadata = doc.metadata or {}
+        if metadata.get("start_index") is None or metadata.get("page") is None:
+            # Chunks ingested without offsets can't be located, so keep them as they are
+            blocks.append((doc.page_content, score))
+            continue
+        groups.setdefault((metadata.get("file_name"), metadata["page"]), []).append((doc, score))
+
+    for chunks in groups.values():
+        chunks.sort(key=lambda item: item[0].metadata["start_index"])
+        text = chunks[0][0].page_content
+        start = chunks[0][0].metadata["start_index"]
+        score = chunks[0][1]
+        for doc, doc_score in chunks[1:]:
+            doc_start = doc.metadata["start_index"]
+            end = start + len(text)
+            if doc_start <= end:
+                # Only the part of the next chunk past the current end is new text
+                text += doc.page_content[end - doc_start:]
+                score = max(score, doc_score)
+            else:
+                blocks.append((text, score))
+                text, start, score = doc.page_content, doc_start, doc_score
+        blocks.append((text, score))
+
+    blocks.sort(key=lambda block: block[1], reverse=True)
+    return blocks
+
+
+def pack(blocks, budget):
+    """Take blocks in order until the token budget is used, truncating the last one if worthwhile"""
+    parts = []
+    used = 0
+    for text, _ in blocks:
+        tokens = estimate_tokens(text)
+        if used + tokens <= budget:
+            parts.append(text)
+            used += tokens
+            continue
+        left = budget - used
+        if left >= min_truncated_tokens or not parts:
+            parts.append(text[:left * chars_per_token])
+        break
+    return parts
+
+
+def assemble_context(documents, k=None, budget=None):
+    """Build the prompt context from retrieved (doc, score) or (doc, score, vector) tuples.
+
+    Returns the context string and a report of how many tokens were saved against joining
+    the top k chunks verbatim.
+    """
+    budget = budget or context_token_budget
+    documents = [item if isinstance(item, tuple) else (item, 0.0) for item in documents]
+
+    # Compare against the old behaviour of joining the top k chunks verbatim
+    naive_tokens = estimate_tokens("\n\n".join(item[0].page_content for item in documents[:k or len(documents)]))
+
+    # Vectors come back from Qdrant with the search results, so MMR costs no extra round trip
+    if documents and len(documents[0]) == 3:
+        documents = select_mmr(documents, k or len(documents))
+    pairs = [(item[0], item[1]) for item in documents]
+
+    context = "\n\n".join(pack(merge_overlapping(pairs), budget))
+    report = {
+        "chunks": len(pairs),
+        "naive_tokens": naive_tokens,
+        "context_tokens": estimate_tokens(context),
+    }
+    report["tokens_saved"] = max(0, naive_tokens - report["context_tokens"])
+    metrics.observe("context_tokens", report["context_tokens"])
+    metrics.increment("context_tokens_saved_total", report["tokens_saved"])
+    print(f"Context: {report['context_tokens']} tokens from {report['chunks']} chunks "
+          f"({report['tokens_saved']} tokens saved)")
+    return context, report
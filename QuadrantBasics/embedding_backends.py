@@ -0,0 +1,160 @@
+import asyncio
+import hashlib
+import math
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.embeddings import Embeddings
+
+
+class EmbeddingBackend(Embeddings):
+    """Base class for embedders: splits work into batches and runs up to `concurrency` of them at once"""
+
+    def __init__(self, batch_size=16, concurrency=1):
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self._dimension = None
+        self._dimension_lock = threading.Lock()
+
+    @property
+    def model_id(self):
+        """Identifies the model that produced a vector; stored with every point"""
+        raise NotImplementedError
+
+    @property
+    def dimension(self):
+        """Number of dimensions, found by embedding a probe string the first time it is needed"""
+        with self._dimension_lock:
+            if self._dimension is None:
+                self._dimension = len(self.embed_query("dimension probe"))
+            return self._dimension
+
+    def _embed_batch(self, texts):
+        raise NotImplementedError
+
+    def _batches(self, texts):
+        return [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+
+    def embed_documents(self, texts):
+        batches = self._batches(list(texts))
+        if self.concurrency <= 1 or len(batches) <= 1:
+            return [vector for batch in batches for vector in self._embed_batch(batch)]
+
+        # map keeps the batches in order, so vectors line up with texts
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            return [vector for vectors in pool.map(self._embed_batch, batches) for vector in vectors]
+
+    def embed_query(self, text):
+        return self._embed_batch([text])[0]
+
+
+class OllamaBackend(EmbeddingBackend):
+    """Embeds through an Ollama server; use a dedicated embedding model, not a chat model"""
+
+    def __init__(self, model="nomic-embed-text", base_url=None, batch_size=16, concurrency=2):
+        super().__init__(batch_size=batch_size, concurrency=concurrency)
+        from langchain_ollama import OllamaEmbeddings
+
+        self.model = model
+        options = {"model": model}
+        if base_url:
+            options["base_url"] = base_url
+        self.client = OllamaEmbeddings(**options)
+
+    @property
+    def model_id(self):
+        return f"ollama/{self.model}"
+
+    def _embed_batch(self, texts):
+        return self.client.embed_documents(texts)
+
+    def embed_query(self, text):
+        return self.client.embed_query(text)
+
+    async def aembed_documents(self, texts):
+        # Same batching and concurrency limit as the sync path, without tying up threads
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def embed(batch):
+            async with semaphore:
+                return await self.client.aembed_documents(batch)
+
+        results = await asyncio.gather(*(embed(batch) for batch in self._batches(list(texts))))
+        return [vector for vectors in results for vector in vectors]
+
+    async def aembed_query(self, text):
+        return await self.client.aembed_query(text)
+
+
+class SentenceTransformerBackend(EmbeddingBackend):
+    """Runs a sentence-transformers model in process on the CPU, loaded from a local path.
+
+    Set onnx=True to use the ONNX runtime export of the model, which is usually faster on CPU.
+    """
+
+    def __init__(self, model_path, batch_size=32, concurrency=1, onnx=False, device="cpu"):
+        super().__init__(batch_size=batch_size, concurrency=concurrency)
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise ImportError("The sentence-transformers backend needs `pip install sentence-transformers`") from e
+
+        self.model_path = model_path
+        options = {"device": device}
+        if onnx:
+            options["backend"] = "onnx"
+        self.model = SentenceTransformer(model_path, **options)
+
+    @property
+    def model_id(self):
+        return f"sentence-transformers/{os.path.basename(os.path.normpath(self.model_path))}"
+
+    def _embed_batch(self, texts):
+        return self.model.encode(texts, batch_size=self.batch_size, normalize_embeddings=True).tolist()
+
+
+class HashingBackend(EmbeddingBackend):
+    """Deterministic feature-hashing embedder with no model at all, for offline tests and benchmarks.
+
+    latency_seconds adds a fixed delay per batch to imitate a real model.
+    """
+
+    def __init__(self, dimension=384, batch_size=64, concurrency=1, latency_seconds=0.0):
+        super().__init__(batch_size=batch_size, concurrency=concurrency)
+        self._dimension = dimension
+        self.latency_seconds = latency_seconds
+
+    @property
+    def model_id(self):
+        return f"hashing/{self._dimension}"
+
+    def _embed_text(self, text):
+        vector = [0.0] * self._dimension
+        for token in re.findall(r"\w+", text.lower()):
+            digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self._dimension
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = math.sqrt(sum(x * x for x in vector))
+        return [x / norm for x in vector] if norm else vector
+
+    def _embed_batch(self, texts):
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        return [self._embed_text(text) for text in texts]
+
+
+BACKENDS = {
+    "ollama": OllamaBackend,
+    "sentence-transformers": SentenceTransformerBackend,
+    "hashing": HashingBackend,
+}
+
+
+def create_backend(name, **options):
+    """Build an embedding backend by name: ollama, sentence-transformers or hashing"""
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend {name}. Use one of: {', '.join(BACKENDS)}")
+    return BACKENDS[name](**options)
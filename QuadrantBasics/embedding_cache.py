@@ -0,0 +1,190 @@
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+
+from langchain_core.embeddings import Embeddings
+
+
+def normalise_text(text):
+    """Normalise text so trivially different spellings of the same input share a cache entry"""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class CachedEmbeddings(Embeddings):
+    """Two tier (in-process LRU + SQLite) cache in front of another Embeddings object"""
+
+    def __init__(self, underlying, model_name, path="embedding_cache.sqlite3",
+                 max_memory_entries=10000, max_disk_entries=500000):
+        self.underlying = underlying
+        self.model_name = model_name
+        self.path = path
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "memory_evictions": 0, "disk_evictions": 0}
+
+        # One connection shared by every thread, guarded by the lock
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, model TEXT NOT NULL, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._db.commit()
+
+    def _key(self, kind, text):
+        # Queries and documents are kept apart because some models embed them differently
+        return hashlib.sha256(f"{self.model_name}\0{kind}\0{normalise_text(text)}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+            self._stats["memory_evictions"] += 1
+
+    def _lookup(self, keys):
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[key] = self._memory[key]
+                    self._stats["memory_hits"] += 1
+
+            # Fall back to the on-disk tier for anything not held in memory
+            missing = [key for key in dict.fromkeys(keys) if key not in found]
+            now = time.time()
+            for start in range(0, len(missing), 500):
+                chunk = missing[start:start + 500]
+                rows = self._db.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                for key, blob in rows:
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    found[key] = vector.tolist()
+                    self._remember(key, found[key])
+                    self._stats["disk_hits"] += 1
+                if rows:
+                    self._db.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?",
+                                         [(now, key) for key, _ in rows])
+            self._db.commit()
+        return found
+
+    def _store(self, entries):
+        now = time.time()
+        with self._lock:
+            for key, vector in entries.items():
+                self._remember(key, vector)
+            self._db.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, model, vector, last_used) VALUES (?, ?, ?, ?)",
+                [(key, self.model_name, array("f", vector).tobytes(), now) for key, vector in entries.items()],
+            )
+
+            # Evict the least recently used rows once the disk tier grows past its cap
+            count = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            if count > self.max_disk_entries:
+                excess = count - int(self.max_disk_entries * 0.9)
+                self._db.execute(
+                    "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (excess,),
+                )
+                self._stats["disk_evictions"] += excess
+            self._db.commit()
+
+    def _missing(self, keys, texts, found):
+        # Only send each distinct uncached text to the model once
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        with self._lock:
+            self._stats["misses"] += len(missing)
+        return missing
+
+    def embed_documents(self, texts):
+        return self._embed_many("document", texts)
+
+    def embed_queries(self, texts):
+        """Embed several queries with one model call, sharing cache entries with embed_query.
+
+        Every backend embeds a query exactly as a one-document batch, so batching queries changes no vectors.
+        """
+        return self._embed_many("query", texts)
+
+    def _embed_many(self, kind, texts):
+        keys = [self._key(kind, text) for text in texts]
+        found = self._lookup(keys)
+        missing = self._missing(keys, texts, found)
+
+        if missing:
+            vectors = self.underlying.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            self._store(computed)
+            found.update(computed)
+
+        return [found[key] for key in keys]
+
+    def embed_query(self, text):
+        key = self._key("query", text)
+        found = self._lookup([key])
+        if key in found:
+            return found[key]
+
+        with self._lock:
+            self._stats["misses"] += 1
+        vector = self.underlying.embed_query(text)
+        self._store({key: vector})
+        return vector
+
+    async def aembed_documents(self, texts):
+        keys = [self._key("document", text) for text in texts]
+        # The SQLite tier blocks, so keep it off the event loop
+        found = await asyncio.to_thread(self._lookup, keys)
+        missing = self._missing(keys, texts, found)
+
+        if missing:
+            vectors = await self.underlying.aembed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            await asyncio.to_thread(self._store, computed)
+            found.update(computed)
+
+        return [found[key] for key in keys]
+
+    async def aembed_query(self, text):
+        key = self._key("query", text)
+        found = await asyncio.to_thread(self._lookup, [key])
+        if key in found:
+            return found[key]
+
+        with self._lock:
+            self._stats["misses"] += 1
+        vector = await self.underlying.aembed_query(text)
+        await asyncio.to_thread(self._store, {key: vector})
+        return vector
+
+    def stats(self):
+        """Return hit/miss counters and the current size of both tiers"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+            stats["disk_entries"] = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
+
+    def clear(self):
+        """Drop every cached vector from both tiers"""
+        with self._lock:
+            self._memory.clear()
+            self._db.execute("DELETE FROM embeddings")
+            self._db.commit()
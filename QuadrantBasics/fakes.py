@@ -0,0 +1,118 @@
+import itertools
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator, List, Optional
+
+from langchain_core.language_models.llms import LLM
+from langchain_core.outputs import GenerationChunk
+
+WORDS = (
+    "invoice renewal registration policy warranty contract payment shipment order customer account "
+    "service support manual section figure table device install configure reset battery sensor "
+    "pressure valve pump motor filter cable connector firmware update error code warning safety "
+    "maintenance schedule inspection report quarter revenue budget approval deadline review"
+).split()
+
+
+class FakeLLM(LLM):
+    """Stand-in for OllamaLLM that answers after a configurable delay, optionally token by token"""
+
+    answer: str = "This is a canned answer generated without a model for offline runs."
+    latency_seconds: float = 0.0
+    token_latency_seconds: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> str:
+        time.sleep(self.latency_seconds + self.token_latency_seconds * len(self.answer.split()))
+        return self.answer
+
+    def _stream(self, prompt: str, stop: Optional[List[str]] = None, run_manager: Any = None,
+                **kwargs: Any) -> Iterator[GenerationChunk]:
+        time.sleep(self.latency_seconds)
+        for i, word in enumerate(self.answer.split()):
+            time.sleep(self.token_latency_seconds)
+            yield GenerationChunk(text=word if i == 0 else " " + word)
+
+
+class FakeSlackClient:
+    """Stand-in for slack_sdk's WebClient that records every message instead of sending it"""
+
+    def __init__(self, latency_seconds=0.0):
+        self.latency_seconds = latency_seconds
+        self.messages = []
+        self._lock = threading.Lock()
+        self._ts = itertools.count(1)
+        self._tags = threading.local()
+
+    @contextmanager
+    def tagged(self, **tags):
+        """Add tags (e.g. the event being answered) to every message this thread sends inside the block"""
+        previous = getattr(self._tags, "tags", {})
+        self._tags.tags = {**previous, **tags}
+        try:
+            yield
+        finally:
+            self._tags.tags = previous
+
+    def _record(self, method, channel, ts, text):
+        time.sleep(self.latency_seconds)
+        with self._lock:
+            self.messages.append({"method": method, "channel": channel, "ts": ts, "text": text,
+                                  "at": time.perf_counter(), **getattr(self._tags, "tags", {})})
+        return {"ok": True, "channel": channel, "ts": ts}
+
+    def chat_postMessage(self, channel, text="", **kwargs):
+        return self._record("chat_postMessage", channel, f"{time.time():.0f}.{next(self._ts):06d}", text)
+
+    def chat_update(self, channel, ts, text="", **kwargs):
+        return self._record("chat_update", channel, ts, text)
+
+    def auth_test(self):
+        return {"ok": True, "user_id": "UFAKEBOT", "user": "fake-bot", "team": "Fake Team"}
+
+
+def random_sentence(rng, words=12):
+    """A sentence of vocabulary words with the odd part number mixed in"""
+    return " ".join(
+        f"PN-{rng.randint(1000, 9999)}" if rng.random() < 0.05 else rng.choice(WORDS)
+        for _ in range(words)
+    )
+
+
+def make_pdf(path, pages, lines_per_page=45, seed=0):
+    """Write a plain text PDF with the given number of pages; no PDF library needed"""
+    rng = random.Random(seed * 100003 + pages)
+    page_ids = [4 + 2 * i for i in range(pages)]
+    objects = {
+        1: "<< /Type /Catalog /Pages 2 0 R >>",
+        2: f"<< /Type /Pages /Kids [{' '.join(f'{page_id} 0 R' for page_id in page_ids)}] /Count {pages} >>",
+        3: "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    }
+    for page_id in page_ids:
+        lines = [random_sentence(rng) for _ in range(lines_per_page)]
+        stream = "BT /F1 10 Tf 12 TL 50 780 Td " + " ".join(f"({line}) Tj T*" for line in lines) + " ET"
+        objects[page_id] = (
+            "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {page_id + 1} 0 R >>"
+        )
+        objects[page_id + 1] = f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream"
+
+    # Objects are written in order and their byte offsets collected for the cross-reference table
+    data = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number in range(1, len(objects) + 1):
+        offsets.append(len(data))
+        data += f"{number} 0 obj\n{objects[number]}\nendobj\n".encode("latin-1")
+    xref = len(data)
+    data += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    data += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode("latin-1")
+    data += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1")
+
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
@@ -0,0 +1,202 @@
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+
+from metrics import metrics
+import tracing
+
+# Lower runs first: people waiting on an answer go ahead of scripts answering questions in bulk
+INTERACTIVE = 0
+BULK = 10
+
+priority_names = {INTERACTIVE: "interactive", BULK: "bulk"}
+
+
+class GenerationTimeout(TimeoutError):
+    """Raised when a request waited longer than its timeout for a free generation slot"""
+
+
+class GenerationManager:
+    """Runs every LLM generation through one compiled chain and a limited number of slots.
+
+    build_chain(model) returns the prompt | model chain; it is compiled once and only rebuilt if
+    get_model() starts returning a different model (e.g. the benchmark swapping in a fake).
+    Requests waiting for a slot are served by priority, then in arrival order.
+    """
+
+    def __init__(self, get_model, build_chain, max_concurrent=1, queue_timeout_seconds=None):
+        self.get_model = get_model
+        self.build_chain = build_chain
+        self.max_concurrent = max_concurrent
+        self.queue_timeout_seconds = queue_timeout_seconds
+        self._chain = None
+        self._chain_model = None
+        self._chain_lock = threading.Lock()
+        self._slots = threading.Condition()
+        self._running = 0
+        self._waiting = []
+        self._arrivals = itertools.count()
+        # Futures of coroutines waiting in the queue, resolved from whichever thread frees a slot
+        self._async_waiters = {}
+
+    @property
+    def chain(self):
+        model = self.get_model()
+        if self._chain is None or self._chain_model is not model:
+            with self._chain_lock:
+                if self._chain is None or self._chain_model is not model:
+                    self._chain = self.build_chain(model)
+                    self._chain_model = model
+        return self._chain
+
+    def warm_up(self):
+        """Load the model into memory now so the first question doesn't pay for it"""
+        started = time.perf_counter()
+        # Ollama loads the model for an empty prompt without generating anything
+        self.chain
+        self.get_model().invoke("")
+        seconds = time.perf_counter() - started
+        metrics.set_gauge("llm_warm_up_seconds", seconds)
+        return seconds
+
+    def invoke(self, chain_input, priority=INTERACTIVE, timeout=None):
+        with self.slot(priority, timeout):
+            with tracing.span("llm"):
+                return self.chain.invoke(chain_input)
+
+    def stream(self, chain_input, priority=INTERACTIVE, timeout=None):
+        """Yield tokens from the chain; the slot is held until the stream is exhausted or closed"""
+        with self.slot(priority, timeout):
+            yield from self.chain.stream(chain_input)
+
+    async def ainvoke(self, chain_input, priority=INTERACTIVE, timeout=None):
+        """Async invoke; waiting for a slot happens on the event loop, so no executor thread is parked"""
+        async with self.slot(priority, timeout):
+            with tracing.span("llm"):
+                return await self.chain.ainvoke(chain_input)
+
+    def slot(self, priority=INTERACTIVE, timeout=None):
+        return _Slot(self, priority, self.queue_timeout_seconds if timeout is None else timeout)
+
+    @property
+    def queue_depth(self):
+        return len(self._waiting)
+
+    def _enqueue(self, priority):
+        ticket = (priority, next(self._arrivals))
+        heapq.heappush(self._waiting, ticket)
+        metrics.set_gauge("llm_queue_depth", len(self._waiting))
+        return ticket
+
+    def _take(self, ticket):
+        # Called with the condition held; True once the ticket is at the head and a slot is free
+        if self._running >= self.max_concurrent or self._waiting[0] != ticket:
+            return False
+        heapq.heappop(self._waiting)
+        self._running += 1
+        metrics.set_gauge("llm_queue_depth", len(self._waiting))
+        # The next ticket is now at the head; wake it in case a slot is still free for it
+        self._notify()
+        return True
+
+    def _leave(self, ticket):
+        self._waiting.remove(ticket)
+        heapq.heapify(self._waiting)
+        metrics.set_gauge("llm_queue_depth", len(self._waiting))
+        # The next request in line may be able to go now that this one has left the queue
+        self._notify()
+
+    def _notify(self):
+        self._slots.notify_all()
+        for loop, future in self._async_waiters.values():
+            loop.call_soon_threadsafe(_resolve, future)
+        self._async_waiters.clear()
+
+    def _timed_out(self, priority, timeout):
+        metrics.increment("llm_queue_timeouts_total", priority=priority_names.get(priority, priority))
+        return GenerationTimeout(f"No free generation slot after {timeout:.0f}s")
+
+    def _record_wait(self, priority, started):
+        wait = time.perf_counter() - started
+        metrics.observe("llm_queue_wait_seconds", wait, priority=priority_names.get(priority, priority))
+        tracing.record_stage("llm_queue", wait)
+
+    def _acquire(self, priority, timeout):
+        started = time.perf_counter()
+        deadline = None if timeout is None else started + timeout
+        with self._slots:
+            ticket = self._enqueue(priority)
+            try:
+                while not self._take(ticket):
+                    remaining = None if deadline is None else deadline - time.perf_counter()
+                    if remaining is not None and remaining <= 0:
+                        raise self._timed_out(priority, timeout)
+                    self._slots.wait(remaining)
+            except BaseException:
+                self._leave(ticket)
+                raise
+        self._record_wait(priority, started)
+
+    async def _aacquire(self, priority, timeout):
+        started = time.perf_counter()
+        deadline = None if timeout is None else started + timeout
+        loop = asyncio.get_running_loop()
+        with self._slots:
+            ticket = self._enqueue(priority)
+        try:
+            while True:
+                with self._slots:
+                    if self._take(ticket):
+                        break
+                    future = loop.create_future()
+                    self._async_waiters[ticket] = (loop, future)
+                remaining = None if deadline is None else deadline - time.perf_counter()
+                if remaining is not None and remaining <= 0:
+                    raise self._timed_out(priority, timeout)
+                try:
+                    await asyncio.wait_for(future, remaining)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            with self._slots:
+                self._async_waiters.pop(ticket, None)
+                self._leave(ticket)
+            raise
+        self._record_wait(priority, started)
+
+    def _release(self):
+        with self._slots:
+            self._running -= 1
+            self._notify()
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class _Slot:
+    __slots__ = ("manager", "priority", "timeout")
+
+    def __init__(self, manager, priority, timeout):
+        self.manager = manager
+        self.priority = priority
+        self.timeout = timeout
+
+    def __enter__(self):
+        self.manager._acquire(self.priority, self.timeout)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.manager._release()
+        return False
+
+    async def __aenter__(self):
+        await self.manager._aacquire(self.priority, self.timeout)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.manager._release()
+        return False
@@ -1,15 +1,27 @@
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_ollama import OllamaEmbeddings
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_ollama.llms import OllamaLLM
-from uuid import uuid4
-from langchain_core.documents import Document
-from langchain_qdrant import QdrantVectorStore
-from qdrant_client import QdrantClient, models
-from qdrant_client.http.models import Distance, VectorParams
+# LangChain, the PDF loader and the Ollama and Qdrant clients are imported where they are first used, so
+# importing this module (bot start up, every Streamlit process, CLI --help) doesn't pay for them
+import time
+import_started = time.perf_counter()
+
+from uuid import NAMESPACE_URL, uuid5
 # from langchain.embeddings import DeepSeekEmbeddings  # Replace with the actual embedding model you're using
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import io
 import os
+from answer_cache import AnswerCache
+from metrics import metrics
+import tracing
+import provisioning
+import sparse
+import context_assembly
+from qdrant_connections import QdrantConnectionManager, VectorStoreRegistry
+from manifest import FileManifest
+from query_batcher import QueryBatcher
+import generation
+from generation import GenerationManager
+import threading
 
 template = """
 You are an assistant that answers questions. Using the following retrieved information, answer the user question. If you don't know the answer, say that you don't know. Use up to three sentences, keeping the answer concise.
@@ -19,50 +31,262 @@ Answer:
 """
 
 
-embeddings = OllamaEmbeddings(model="deepseek-r1:1.5b")
+# Which embedder to use: "ollama", "sentence-transformers" (in process, from a local model path) or "hashing" (offline tests)
+embedding_backend_name = "ollama"
+embedding_backend_options = {"model": "nomic-embed-text", "batch_size": 16, "concurrency": 2}
+
+# Cached embedding vectors survive Streamlit reruns and bot restarts
+embedding_cache_path = "embedding_cache.sqlite3"
+
+llm_model_name = "deepseek-r1:1.5b"
+
+# How long Ollama keeps the model loaded after the last request ("30m", "1h", or -1 to never unload it)
+llm_keep_alive = "1h"
+
+# Generations sent to Ollama at once; match OLLAMA_NUM_PARALLEL on the server
+llm_max_concurrent_generations = 1
+
+# Seconds a question may wait for a free generation slot, and for Ollama to respond once it has one
+llm_queue_timeout_seconds = 120
+llm_request_timeout_seconds = 300
+
+# Answers to questions that embed close to an earlier question for the same company are reused
+answer_cache = AnswerCache(
+    similarity_threshold=0.95,
+    ttl_seconds=3600,
+    max_entries_per_company=256,
+    # The manifest file is rewritten by every ingest, whichever process runs it
+    version=lambda company: file_manifest.version(company),
+)
+tracing.register_stats("answer_cache", answer_cache.stats)
 
-model = OllamaLLM(model="deepseek-r1:1.5b")
+# Companies whose collections also store sparse lexical vectors for hybrid (dense + keyword) search
+hybrid_companies = set()
+
+# Candidates each of the dense and sparse searches contribute before reciprocal rank fusion
+hybrid_prefetch_limit = 20
+
+# Whether each known collection has the sparse vector, filled in as collections are connected
+hybrid_collections = {}
+
+# Per-company record of ingested files (name, hash, chunk count, bytes, ingest time)
+file_manifest = FileManifest(directory="manifests")
+
+# Seconds collection statistics are reused before Qdrant is asked again
+stats_ttl_seconds = 10
+
+stats_cache = {}
+stats_lock = threading.Lock()
 
 url = "localhost:6333"
 
+# "per_company" gives every company its own collection. "shared" keeps every company in shared_collection_name,
+# partitioned by the tenant-indexed metadata.company field, which scales to thousands of small companies.
+# Run migrate_tenants.py before switching an existing deployment to "shared".
+collection_layout = "per_company"
+shared_collection_name = "companies"
+
 pdfs_directory = 'pdfs/'
 
-database_list = {}
+# Vector stores created this session, bounded and safe to share between bot threads
+database_list = VectorStoreRegistry(max_size=256)
+
+# Number of chunks embedded and upserted together during ingestion
+ingest_batch_size = 32
+
+# Namespace for the deterministic point IDs derived from (company, file hash, chunk index)
+point_id_namespace = uuid5(NAMESPACE_URL, "quadrantbasics/points")
+
+# Number of upserts allowed in flight while the next batch is being embedded
+ingest_max_pending_upserts = 2
+
+# Questions arriving within this many seconds of each other (from any company) share one embedding call
+# and one Qdrant batch query per collection; 0 sends every question on its own
+query_batch_window_seconds = 0.005
+query_batch_max_size = 32
+
+# One pooled client per process; every Qdrant call in this module goes through it with retries
+connections = QdrantConnectionManager(url, prefer_grpc=True, timeout=30, max_retries=3)
+
+qdrant_client = connections.retrying
+
+# embedding_backend, embedding_model_name (stored with every point so a collection is never searched with
+# vectors from a different model), embeddings and model are built on first use by these factories.
+# Assigning one of them (as benchmark.py does) replaces it.
+lazy_lock = threading.RLock()
+
+
+def build_embedding_backend():
+    from embedding_backends import create_backend
+    return create_backend(embedding_backend_name, **embedding_backend_options)
+
+
+def build_embeddings():
+    from embedding_cache import CachedEmbeddings
+    return CachedEmbeddings(
+        get_embedding_backend(),
+        model_name=get_embedding_model_name(),
+        path=embedding_cache_path,
+        max_memory_entries=10000,
+        max_disk_entries=500000,
+    )
+
+
+def build_model():
+    from langchain_ollama.llms import OllamaLLM
+    return OllamaLLM(
+        model=llm_model_name,
+        keep_alive=llm_keep_alive,
+        client_kwargs={"timeout": llm_request_timeout_seconds},
+    )
 
-qdrant_client = QdrantClient(url=url)
+
+def build_chain(model):
+    from langchain_core.prompts import ChatPromptTemplate
+    return ChatPromptTemplate.from_template(template) | model
+
+
+lazy_attributes = {
+    "embedding_backend": build_embedding_backend,
+    "embedding_model_name": lambda: get_embedding_backend().model_id,
+    "embeddings": build_embeddings,
+    "model": build_model,
+}
+
+
+def lazy(name):
+    if name not in globals():
+        with lazy_lock:
+            if name not in globals():
+                started = time.perf_counter()
+                globals()[name] = lazy_attributes[name]()
+                metrics.observe("lazy_init_seconds", time.perf_counter() - started, attribute=name)
+    return globals()[name]
+
+
+def __getattr__(name):
+    # Module attribute access (main.embeddings) builds lazy attributes the same way
+    if name in lazy_attributes:
+        return lazy(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# Scraping must not build the embedder, so its cache is only reported once something has used it
+tracing.register_stats("embedding_cache", lambda: globals()["embeddings"].stats() if "embeddings" in globals() else {})
+
+
+def get_embedding_backend():
+    return lazy("embedding_backend")
+
+
+def get_embedding_model_name():
+    return lazy("embedding_model_name")
+
+
+def get_embeddings():
+    return lazy("embeddings")
+
+
+def get_model():
+    return lazy("model")
+
+
+def preload():
+    """Build the embedder, LLM client and Qdrant client and import the PDF stack ahead of the first request"""
+    started = time.perf_counter()
+    try:
+        get_embeddings()
+        get_model()
+        connections.client
+        from pypdf import PdfReader  # noqa: F401
+        from langchain_text_splitters import RecursiveCharacterTextSplitter  # noqa: F401
+        from langchain_core.prompts import ChatPromptTemplate  # noqa: F401
+        from langchain_qdrant import QdrantVectorStore  # noqa: F401
+        # Loading the model into Ollama is the slowest part of a cold first answer
+        print(f"Warmed up {llm_model_name} in {generation_manager.warm_up():.2f}s")
+    except Exception as e:
+        # Nothing is lost; whatever failed is built again when a request first needs it
+        print(f"Error preloading models and clients: {str(e)}")
+        return
+    seconds = time.perf_counter() - started
+    metrics.set_gauge("preload_seconds", seconds)
+    print(f"Preloaded models and clients in {seconds:.2f}s")
 
 # DONE Create a list of JSON objects that are db instances and the names of the companies (with the collection in the names
 # DONE add the db name to the list in the create_qdrant_database function
 # DONE CHANGE DATABASE LIST TO JSON FOR EASIER ACCESS
 
 
-def create_qdrant_database(company_name):
-    # Return existing database instance if already created in this session
-    if company_name in database_list:
-        return database_list[company_name]
+def run_query_batch(collection_name, requests):
+    # Every request in the batch goes to Qdrant in a single round trip
+    return [response.points for response in qdrant_client.query_batch_points(collection_name=collection_name,
+                                                                             requests=requests)]
+
+
+query_batcher = QueryBatcher(
+    embed_texts=lambda texts: get_embeddings().embed_queries(texts),
+    run_queries=run_query_batch,
+    window_seconds=query_batch_window_seconds,
+    max_batch_size=query_batch_max_size,
+)
+
+
+# Every answer goes through here: one compiled chain, a cap on concurrent generations, interactive questions first
+generation_manager = GenerationManager(
+    get_model,
+    build_chain,
+    max_concurrent=llm_max_concurrent_generations,
+    queue_timeout_seconds=llm_queue_timeout_seconds,
+)
 
-    # Connect to existing collection or create new one
-    try:
-        # Try to connect to existing collection
-        vector_db = QdrantVectorStore(
-            client=qdrant_client,
-            collection_name=company_name,
-            embeddings=embeddings,
-        )
-    except Exception:
-        # If collection doesn't exist, create a new one
-        vector_db = QdrantVectorStore.from_documents(
-            [],  # Empty docs since we'll add them later
-            embeddings,
-            url=url,
-            prefer_grpc=True,
-            collection_name=company_name,
-        )
 
-    # Add the database instance to our session cache
-    database_list[company_name] = vector_db
+def embed_question(question, company=None):
+    with tracing.span("embed_query", company):
+        if query_batch_window_seconds:
+            return query_batcher.embed(question)
+        return get_embeddings().embed_query(question)
 
-    return vector_db
+
+def create_qdrant_database(company_name, hybrid=None):
+    # Return existing database instance if already created in this session, otherwise create it once
+    if hybrid is None:
+        hybrid = company_name in hybrid_companies
+    return database_list.get_or_create(company_name, lambda: connect_vector_store(company_name, hybrid))
+
+
+def collection_for_company(company):
+    # Every Qdrant call goes through this, so callers never need to know which layout is in use
+    return shared_collection_name if collection_layout == "shared" else company
+
+
+def forget_collection_files(company):
+    # A brand new collection holds none of the files an older manifest remembers; in the shared layout
+    # that is true of every company's manifest, not just the one whose request created it
+    if collection_layout == "shared":
+        file_manifest.clear_all()
+    else:
+        file_manifest.clear(company)
+
+
+def connect_vector_store(company_name, hybrid=False):
+    # Create the collection explicitly, or bring an existing one up to the current settings
+    from langchain_qdrant import QdrantVectorStore
+
+    collection_name = collection_for_company(company_name)
+    dimension = get_embedding_backend().dimension
+    if provisioning.ensure_collection(qdrant_client, collection_name, dimension, hybrid=hybrid,
+                                      shared=collection_layout == "shared"):
+        forget_collection_files(company_name)
+    else:
+        provisioning.check_embedding_model(qdrant_client, collection_name, get_embedding_model_name())
+    hybrid_collections[collection_name] = provisioning.has_sparse_vector(qdrant_client, collection_name)
+
+    # Connect to the collection
+    return QdrantVectorStore(
+        client=connections.client,
+        collection_name=collection_name,
+        embedding=get_embeddings(),
+    )
 
 
 def upload_pdf(file):
@@ -71,72 +295,478 @@ def upload_pdf(file):
         f.write(file.getbuffer())
 
 
-def add_documents_to_vector_db(db, file_path, company):
-    # Create a loader from the file path
-    loader = PyPDFLoader(file_path)
-    documents = loader.load()
+def hash_bytes(data):
+    # Hash raw file content so the same PDF is recognised under any file name
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(file_path, block_size=1 << 20):
+    # Hash the file in blocks so large PDFs are never read into memory at once
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def point_id(company, file_hash, chunk_index):
+    # The same chunk of the same content always maps to the same point, so retries overwrite instead of duplicating
+    return str(uuid5(point_id_namespace, f"{company}:{file_hash}:{chunk_index}"))
+
+
+def document_exists(company, file_hash):
+    # The manifest answers for files ingested through this deployment without asking Qdrant
+    if file_manifest.get(company, file_hash):
+        return True
+
+    # The first chunk is only marked complete once every batch of the file has been upserted
+    points = qdrant_client.retrieve(
+        collection_name=collection_for_company(company),
+        ids=[point_id(company, file_hash, 0)],
+        with_payload=["ingest_complete"],
+        with_vectors=False,
+    )
+    if points and is_complete(points[0].payload, file_hash):
+        return True
+
+    # A version written by update_file keeps unchanged chunks under older IDs, so its marker can be on any
+    # of them; ingest_complete is indexed, so this only touches points carrying the marker
+    marked, _ = qdrant_client.scroll(
+        collection_name=collection_for_company(company),
+        scroll_filter=completion_filter(company, file_hash),
+        limit=1,
+        with_payload=False,
+        with_vectors=False,
+    )
+    return bool(marked)
+
+
+def is_complete(payload, file_hash):
+    # Every ingest and update marks one of the file's chunks with the file hash once all of them are stored
+    return payload.get("ingest_complete") == file_hash
+
+
+def completion_filter(company, file_hash):
+    from qdrant_client import models
+
+    return models.Filter(must=[
+        *company_filter(company).must,
+        models.FieldCondition(key="ingest_complete", match=models.MatchValue(value=file_hash)),
+    ])
 
-    # Calculate the file name from the path
-    file_name = os.path.basename(file_path)
 
-    doc_list = retrieve_doc_by_metadata(company=company, file_name=file_name)
+def completion_marker(company, file_hash):
+    # Arguments for set_payload that flag a file as completely ingested
+    return {
+        "collection_name": collection_for_company(company),
+        "payload": {"ingest_complete": file_hash},
+        "points": [point_id(company, file_hash, 0)],
+    }
+
+
+def open_pdf(source):
+    # pypdf reads from a path or straight from uploaded bytes, so uploads never need writing to disk first
+    from pypdf import PdfReader
+    return PdfReader(io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source)
+
+
+def pdf_page_count(source):
+    return len(open_pdf(source).pages)
+
+
+def iter_pages(source):
+    # Extract text one page at a time, as it is needed, so a large PDF's text is never held in memory at once
+    from langchain_core.documents import Document
 
-    if len(doc_list[0]) > 0:
-        return "Doc Already Exists"
+    for page_number, page in enumerate(open_pdf(source).pages):
+        yield Document(page_content=page.extract_text(), metadata={"page": page_number})
 
-    # Create a text splitter to split the document up into multiple documents
+
+def iter_chunks(source, file_name, company, keep_page=None):
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    # Create a text splitter to split each page up into multiple documents
     text_splitter = RecursiveCharacterTextSplitter(
         chunk_size=2000,
         chunk_overlap=300,
         add_start_index=True
     )
 
-    # Run the text splitter on the uploaded document
-    chunked_docs = text_splitter.split_documents(documents)
+    chunk_index = 0
+    pages = iter_pages(source)
+    while True:
+        # Parsing and splitting are timed separately; both happen lazily as batches are pulled
+        with tracing.span("parse_pdf", company):
+            page = next(pages, None)
+        if page is None:
+            break
+        # The page fingerprint lets an updated version of the file skip pages that didn't change
+        page_hash = hash_bytes(page.page_content.encode("utf-8"))
+        if keep_page:
+            kept_chunks = keep_page(page.metadata.get("page"), page_hash)
+            if kept_chunks is not None:
+                chunk_index += kept_chunks
+                continue
+        with tracing.span("split", company):
+            chunks = text_splitter.split_documents([page])
+        for doc in chunks:
+            # Keep the page and offset so neighbouring chunks can be located later
+            doc.metadata = {
+                "file_name": file_name,
+                "company": company,
+                "page": page.metadata.get("page"),
+                "page_hash": page_hash,
+                "start_index": doc.metadata.get("start_index"),
+                "chunk_index": chunk_index,
+                "chunk_hash": hash_bytes(doc.page_content.encode("utf-8")),
+            }
+            chunk_index += 1
+            yield doc
+
+
+def iter_batches(items, batch_size):
+    # Group an iterable into lists of at most batch_size items
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
 
-    # Prepare metadata
-    metadata = {
-        "file_name": file_name,
-        "company": company
-    }
 
-    # Update metadata for each chunk
+def assign_point_ids(company, file_hash, chunked_docs):
+    # Tag each chunk with its file hash and embedding model, and derive its deterministic point ID
     for doc in chunked_docs:
-        doc.metadata = metadata
+        doc.metadata["file_hash"] = file_hash
+        doc.metadata["embedding_model"] = get_embedding_model_name()
+    return [point_id(company, file_hash, doc.metadata["chunk_index"]) for doc in chunked_docs]
 
-    # Convert documents to strings for embedding
-    str_docs = [str(doc.page_content) for doc in chunked_docs]
-    
-    # Generate embeddings
-    embedded_docs = embeddings.embed_documents(str_docs)
 
-    # Generate UUIDs for each chunk
-    uuids = [str(uuid4()) for _ in range(len(chunked_docs))]
+def unstored_chunks(ids, chunked_docs, stored):
+    # Keep only the chunks whose point is missing or holds different text
+    stored_hashes = {str(p.id): p.payload.get("metadata", {}).get("chunk_hash") for p in stored}
+    return [
+        (ids[i], doc) for i, doc in enumerate(chunked_docs)
+        if stored_hashes.get(ids[i]) != doc.metadata["chunk_hash"]
+    ]
+
+
+def is_hybrid(company):
+    # Look the collection up once if it was never connected through create_qdrant_database
+    collection_name = collection_for_company(company)
+    if collection_name not in hybrid_collections:
+        hybrid_collections[collection_name] = provisioning.has_sparse_vector(qdrant_client, collection_name)
+    return hybrid_collections[collection_name]
+
+
+def point_vector(text, dense_vector, hybrid):
+    # Hybrid collections store a sparse lexical vector alongside the default dense one
+    if not hybrid:
+        return dense_vector
+    return {"": dense_vector, sparse.SPARSE_VECTOR_NAME: sparse.document_vector(text)}
+
+
+def build_points(new_chunks, embedded_docs, hybrid=False):
+    from qdrant_client import models
 
     # Create points with document content in payload
-    points = [
-        {
-            "id": uuids[i],
-            "vector": embedded_docs[i],
-            "payload": {
-                "text": chunked_docs[i].page_content,  # Store the actual text content
-                "metadata": chunked_docs[i].metadata  # Store metadata separately
+    return [
+        models.PointStruct(
+            id=new_chunks[i][0],
+            vector=point_vector(new_chunks[i][1].page_content, embedded_docs[i], hybrid),
+            payload={
+                "text": new_chunks[i][1].page_content,  # Store the actual text content
+                "metadata": new_chunks[i][1].metadata  # Store metadata separately
             }
-        }
-        for i in range(len(chunked_docs))
+        )
+        for i in range(len(new_chunks))
     ]
 
-    # Add the documents to the qdrant collection
-    qdrant_client.upsert(
-        collection_name=company,
-        points=points
-    )
+
+def report_batch_progress(file_name, batch_number, chunked_docs, total_chunks, skipped_chunks, batch_seconds,
+                          progress_callback=None):
+    progress = {
+        "file_name": file_name,
+        "batch": batch_number,
+        "batch_chunks": len(chunked_docs),
+        "total_chunks": total_chunks,
+        "skipped_chunks": skipped_chunks,
+        "last_page": chunked_docs[-1].metadata.get("page"),
+        "batch_seconds": batch_seconds,
+        "chunks_per_second": len(chunked_docs) / batch_seconds if batch_seconds else 0.0,
+    }
+    print(f"[{file_name}] batch {batch_number}: {len(chunked_docs)} chunks up to page {progress['last_page']} "
+          f"in {batch_seconds:.2f}s ({progress['chunks_per_second']:.1f} chunks/s), {total_chunks} total")
+    if progress_callback:
+        progress_callback(progress)
+
+
+def add_documents_to_vector_db(db, file_path, company, batch_size=None, progress_callback=None):
+    batch_size = batch_size or ingest_batch_size
+
+    # Calculate the file name from the path
+    file_name = os.path.basename(file_path)
+
+    # Hash the content and check for it before any parsing or embedding happens
+    file_hash = hash_file(file_path)
+
+    with tracing.trace_request("ingest", company, file_name=file_name):
+        if document_exists(company, file_hash):
+            return "Doc Already Exists"
+        # A new version of a file that is already stored only re-embeds what changed
+        stored = stored_pages(company, file_name)
+        if stored:
+            return update_file(file_path, file_name, file_hash, os.path.getsize(file_path), company, stored,
+                               batch_size, progress_callback)
+        return ingest_new_file(file_path, file_name, file_hash, os.path.getsize(file_path), company, batch_size,
+                               progress_callback)
+
+
+def add_pdf_bytes_to_vector_db(db, data, file_name, company, batch_size=None, progress_callback=None):
+    # Same as add_documents_to_vector_db for a PDF already in memory, such as a Streamlit upload
+    batch_size = batch_size or ingest_batch_size
+    file_hash = hash_bytes(data)
+
+    with tracing.trace_request("ingest", company, file_name=file_name):
+        if document_exists(company, file_hash):
+            return "Doc Already Exists"
+        stored = stored_pages(company, file_name)
+        if stored:
+            return update_file(data, file_name, file_hash, len(data), company, stored, batch_size, progress_callback)
+        return ingest_new_file(data, file_name, file_hash, len(data), company, batch_size, progress_callback)
+
+
+def ingest_new_file(source, file_name, file_hash, size_bytes, company, batch_size, progress_callback=None):
+    started = time.perf_counter()
+    total_chunks = 0
+    skipped_chunks = 0
+    pending_upserts = deque()
+
+    # Upserts run on a background thread so the next batch can be embedded meanwhile
+    with ThreadPoolExecutor(max_workers=1) as upsert_pool:
+        for batch_number, chunked_docs in enumerate(iter_batches(iter_chunks(source, file_name, company), batch_size), 1):
+            batch_started = time.perf_counter()
+            ids = assign_point_ids(company, file_hash, chunked_docs)
+
+            # Skip chunks a previous, interrupted run already stored with the same text
+            with tracing.span("qdrant_retrieve", company):
+                stored = qdrant_client.retrieve(collection_name=collection_for_company(company), ids=ids,
+                                                with_payload=["metadata"], with_vectors=False)
+            new_chunks = unstored_chunks(ids, chunked_docs, stored)
+            skipped_chunks += len(chunked_docs) - len(new_chunks)
+
+            # Generate embeddings for this batch only
+            with tracing.span("embed_documents", company):
+                embedded_docs = get_embeddings().embed_documents([str(doc.page_content) for _, doc in new_chunks]) if new_chunks else []
+
+            # Create points with document content in payload
+            points = build_points(new_chunks, embedded_docs, hybrid=is_hybrid(company))
+
+            # Wait for the oldest upsert before queueing another so memory stays bounded
+            with tracing.span("upsert_backpressure", company):
+                while len(pending_upserts) >= ingest_max_pending_upserts:
+                    pending_upserts.popleft().result()
+
+            # Add the documents to the qdrant collection
+            if points:
+                pending_upserts.append(upsert_pool.submit(tracing.in_request(upsert_points), company, points))
+
+            total_chunks += len(chunked_docs)
+            report_batch_progress(file_name, batch_number, chunked_docs, total_chunks, skipped_chunks,
+                                  time.perf_counter() - batch_started, progress_callback)
+
+        # Make sure every batch has landed before reporting success
+        while pending_upserts:
+            pending_upserts.popleft().result()
+
+    # Mark the file as fully ingested so later uploads of the same content are skipped
+    if total_chunks:
+        qdrant_client.set_payload(**completion_marker(company, file_hash))
+
+    # Remember the file locally so the sidebar and dedup checks don't need Qdrant
+    file_manifest.record(company, file_hash, file_name, total_chunks, size_bytes)
+
+    # Answers and statistics from before this file existed are now out of date
+    answer_cache.invalidate(company)
+    invalidate_stats(company)
+
+    elapsed = time.perf_counter() - started
+    print(f"[{file_name}] ingested {total_chunks} chunks ({skipped_chunks} already stored) in {elapsed:.2f}s "
+          f"({total_chunks / elapsed if elapsed else 0.0:.1f} chunks/s)")
     return "Docs added to db"
 
 
-def retrieve_doc_by_metadata(company, file_name):
-    client = QdrantClient(url=url)
+def stored_pages(company, file_name):
+    # Page fingerprints and point IDs of every stored chunk of a file, keyed by page number (no vectors)
+    pages = {}
+    offset = None
+    with tracing.span("qdrant_scroll", company):
+        while True:
+            points, offset = qdrant_client.scroll(
+                collection_name=collection_for_company(company),
+                scroll_filter=file_filter(company, file_name),
+                limit=1000,
+                offset=offset,
+                with_payload=["metadata"],
+                with_vectors=False,
+            )
+            for point in points:
+                metadata = point.payload.get("metadata", {})
+                page = pages.setdefault(metadata.get("page"), {"page_hashes": set(), "ids": [], "file_hashes": []})
+                # Chunks stored before pages were fingerprinted have no page_hash, so their pages never match
+                page["page_hashes"].add(metadata.get("page_hash"))
+                page["ids"].append(str(point.id))
+                page["file_hashes"].append(metadata.get("file_hash"))
+            if offset is None:
+                return pages
+
 
+def stored_vectors(company, ids):
+    # Dense vectors of stored chunks keyed by chunk hash, so identical text is never embedded twice
+    if not ids:
+        return {}
+    with tracing.span("qdrant_retrieve", company):
+        points = qdrant_client.retrieve(collection_name=collection_for_company(company), ids=ids,
+                                        with_payload=["metadata"], with_vectors=True)
+    vectors = {}
+    for point in points:
+        vector = point.vector[""] if isinstance(point.vector, dict) else point.vector
+        vectors[point.payload.get("metadata", {}).get("chunk_hash")] = vector
+    return vectors
+
+
+def update_file(source, file_name, file_hash, size_bytes, company, stored, batch_size, progress_callback=None):
+    from qdrant_client import models
+
+    started = time.perf_counter()
+    # kept: untouched chunks of unchanged pages; reused: chunks of changed pages rewritten with their stored
+    # vector; added: newly embedded chunks; deleted: old points removed from changed and removed pages
+    counts = {"kept": 0, "reused": 0, "deleted": 0, "added": 0}
+    kept_pages = set()
+    # Any one point of the new version carries its completion marker
+    version_points = []
+    total_chunks = 0
+    pending_upserts = deque()
+
+    def keep_page(page_number, page_hash):
+        # Points of a page whose text is unchanged are left exactly as they are
+        page = stored.get(page_number)
+        if page and page["page_hashes"] == {page_hash}:
+            kept_pages.add(page_number)
+            if not version_points:
+                version_points.append(page["ids"][0])
+            counts["kept"] += len(page["ids"])
+            return len(page["ids"])
+        return None
+
+    with ThreadPoolExecutor(max_workers=1) as upsert_pool:
+        changed_chunks = iter_chunks(source, file_name, company, keep_page=keep_page)
+        for batch_number, chunked_docs in enumerate(iter_batches(changed_chunks, batch_size), 1):
+            batch_started = time.perf_counter()
+            ids = assign_point_ids(company, file_hash, chunked_docs)
+            new_chunks = list(zip(ids, chunked_docs))
+            if not version_points:
+                version_points.append(ids[0])
+
+            # Chunks of a changed page that still read the same reuse their stored vectors
+            changed_pages = dict.fromkeys(doc.metadata["page"] for doc in chunked_docs)
+            reusable = stored_vectors(company, [point for page in changed_pages
+                                                for point in stored.get(page, {}).get("ids", [])])
+            to_embed = [doc for doc in chunked_docs if doc.metadata["chunk_hash"] not in reusable]
+            with tracing.span("embed_documents", company):
+                embedded = get_embeddings().embed_documents([str(doc.page_content) for doc in to_embed]) if to_embed else []
+            vectors = dict(zip((doc.metadata["chunk_hash"] for doc in to_embed), embedded))
+            vectors.update(reusable)
+            counts["reused"] += len(chunked_docs) - len(to_embed)
+            counts["added"] += len(to_embed)
+
+            points = build_points(new_chunks, [vectors[doc.metadata["chunk_hash"]] for doc in chunked_docs],
+                                  hybrid=is_hybrid(company))
+
+            with tracing.span("upsert_backpressure", company):
+                while len(pending_upserts) >= ingest_max_pending_upserts:
+                    pending_upserts.popleft().result()
+            pending_upserts.append(upsert_pool.submit(tracing.in_request(upsert_points), company, points))
+
+            total_chunks += len(chunked_docs)
+            report_batch_progress(file_name, batch_number, chunked_docs, total_chunks,
+                                  counts["kept"] + counts["reused"], time.perf_counter() - batch_started,
+                                  progress_callback)
+
+        while pending_upserts:
+            pending_upserts.popleft().result()
+
+    # Only once the new chunks are stored, remove the old ones from changed and removed pages, so
+    # searches never see a page missing. Chunks written by this version (a re-run) are left alone.
+    replaced_pages = [page for page in stored if page not in kept_pages]
+    if replaced_pages:
+        with tracing.span("qdrant_delete", company):
+            qdrant_client.delete(
+                collection_name=collection_for_company(company),
+                points_selector=models.FilterSelector(filter=models.Filter(
+                    must=[*file_filter(company, file_name).must],
+                    should=replaced_page_conditions(replaced_pages),
+                    must_not=[
+                        models.FieldCondition(key="metadata.file_hash", match=models.MatchValue(value=file_hash)),
+                    ],
+                )),
+            )
+        # The same points the filter matches: everything on those pages not written by this version
+        counts["deleted"] = sum(stored_hash != file_hash for page in replaced_pages
+                                for stored_hash in stored[page]["file_hashes"])
+
+    # Kept chunks still carry the markers of the versions that wrote them, which would make those versions
+    # look stored; clear every marker of the file and mark this version complete instead
+    with tracing.span("qdrant_set_payload", company):
+        qdrant_client.delete_payload(
+            collection_name=collection_for_company(company),
+            keys=["ingest_complete"],
+            points=models.FilterSelector(filter=file_filter(company, file_name)),
+        )
+        if version_points:
+            qdrant_client.set_payload(collection_name=collection_for_company(company),
+                                      payload={"ingest_complete": file_hash}, points=version_points)
+
+    # The old version's manifest entry is replaced by this one
+    for entry in file_manifest.files(company):
+        if entry["file_name"] == file_name and entry["file_hash"] != file_hash:
+            file_manifest.remove(company, entry["file_hash"])
+    stored_chunks = counts["kept"] + counts["reused"] + counts["added"]
+    file_manifest.record(company, file_hash, file_name, stored_chunks, size_bytes)
+
+    answer_cache.invalidate(company)
+    invalidate_stats(company)
+
+    elapsed = time.perf_counter() - started
+    print(f"[{file_name}] updated in {elapsed:.2f}s: kept {counts['kept']} chunks, reused {counts['reused']} "
+          f"vectors, deleted {counts['deleted']}, added {counts['added']}")
+    if progress_callback:
+        progress_callback({**counts, "total_chunks": stored_chunks})
+    return "Doc Updated"
+
+
+def replaced_page_conditions(pages):
+    # Conditions matching chunks on any of the given pages; chunks stored before pages were recorded
+    # have no metadata.page at all (stored_pages keys them under None), and MatchAny can't match None
+    from qdrant_client import models
+
+    conditions = []
+    numbered = [page for page in pages if page is not None]
+    if numbered:
+        conditions.append(models.FieldCondition(key="metadata.page", match=models.MatchAny(any=numbered)))
+    if len(numbered) < len(pages):
+        conditions.append(models.IsEmptyCondition(is_empty=models.PayloadField(key="metadata.page")))
+    return conditions
+
+
+def upsert_points(company, points):
+    with tracing.span("qdrant_upsert", company):
+        qdrant_client.upsert(collection_name=collection_for_company(company), points=points)
+
+
+def retrieve_doc_by_metadata(company, file_name):
     # query_text = ""
     #
     # query_vector = embeddings.embed_query(query_text)
@@ -153,25 +783,62 @@ def retrieve_doc_by_metadata(company, file_name):
     #     filter=filter
     # )
 
-    result = client.scroll(
-        collection_name=company,
-        scroll_filter=models.Filter(
-            must=[
-                models.FieldCondition(
-                    key="file_name",
-                    match=models.MatchValue(value=file_name),
-                ),
-            ]
-        ),
+    result = qdrant_client.scroll(
+        collection_name=collection_for_company(company),
+        scroll_filter=file_filter(company, file_name),
     )
 
     print(result)
     return result
 
 
-def retrieve_docs(db, query, company, k=4):
+def collection_stats(company):
+    # Reuse recent statistics so every Streamlit rerun doesn't go back to Qdrant
+    now = time.time()
+    with stats_lock:
+        cached = stats_cache.get(company)
+        if cached and now - cached["computed_at"] < stats_ttl_seconds:
+            return cached
+
+    # count only returns a number, so no payloads travel over the wire
+    files = file_manifest.files(company)
+    stats = {
+        "chunks": qdrant_client.count(collection_name=collection_for_company(company), count_filter=company_filter(company), exact=True).count,
+        "files": len(files),
+        "bytes": sum(entry["bytes"] for entry in files),
+        "last_ingested_at": max((entry["ingested_at"] for entry in files), default=None),
+        "computed_at": now,
+    }
+    with stats_lock:
+        stats_cache[company] = stats
+    return stats
+
+
+def invalidate_stats(company):
+    with stats_lock:
+        stats_cache.pop(company, None)
+
+
+def file_filter(company, file_name):
+    from qdrant_client import models
+
+    return models.Filter(
+        must=[
+            # The company condition is what keeps companies apart in the shared layout
+            *company_filter(company).must,
+            models.FieldCondition(
+                key="metadata.file_name",  # Chunks store the file name inside their metadata
+                match=models.MatchValue(value=file_name),
+            ),
+        ]
+    )
+
+
+def company_filter(company):
+    from qdrant_client import models
+
     # Create a filter for the company metadata using Qdrant models
-    search_filter = models.Filter(
+    return models.Filter(
         must=[
             models.FieldCondition(
                 key="metadata.company",  # Updated to match new payload structure
@@ -179,21 +846,96 @@ def retrieve_docs(db, query, company, k=4):
             )
         ]
     )
+
+
+def retrieve_docs(db, query, company, k=4, query_vector=None, with_vectors=False):
+    if query_batch_window_seconds:
+        # Embedded (if needed) and searched together with any other questions arriving at the same moment
+        with tracing.span("query_batch", company):
+            results = query_batcher.search(
+                collection_for_company(company),
+                query,
+                lambda vector: query_request(company, query, vector, k, with_vectors),
+                query_vector=query_vector,
+            )
+        return results_to_documents(results, with_vectors)
+
+    search_filter = company_filter(company)
     
-    # Get the client from the database
-    client = db._client
-    
-    # Get embeddings for the query
-    query_vector = embeddings.embed_query(query)
-    
-    # Search with metadata filter
-    results = client.search(
-        collection_name=company,
-        query_vector=query_vector,
-        query_filter=search_filter,
-        limit=k
-    )
+    # Get embeddings for the query unless the caller already has them
+    if query_vector is None:
+        with tracing.span("embed_query", company):
+            query_vector = get_embeddings().embed_query(query)
     
+    with tracing.span("qdrant_search", company):
+        results = search_points(company, query, query_vector, search_filter, k, with_vectors)
+    return results_to_documents(results, with_vectors)
+
+
+def search_points(company, query, query_vector, search_filter, k, with_vectors=False):
+    if is_hybrid(company):
+        # Dense and keyword candidates are fused server side in a single round trip
+        results = qdrant_client.query_points(
+            **hybrid_query(collection_for_company(company), query, query_vector, search_filter, k),
+            with_vectors=with_vectors
+        ).points
+    else:
+        # Search with metadata filter
+        results = qdrant_client.query_points(
+            collection_name=collection_for_company(company),
+            query=query_vector,
+            query_filter=search_filter,
+            search_params=provisioning.search_params(),
+            with_payload=True,
+            with_vectors=with_vectors,
+            limit=k
+        ).points
+    return results
+
+
+def query_request(company, query, query_vector, k, with_vectors=False):
+    from qdrant_client import models
+
+    # The same search as search_points, as one entry of a query_batch_points call
+    search_filter = company_filter(company)
+    if is_hybrid(company):
+        hybrid = hybrid_query(collection_for_company(company), query, query_vector, search_filter, k)
+        return models.QueryRequest(prefetch=hybrid["prefetch"], query=hybrid["query"], filter=search_filter,
+                                   limit=k, with_payload=True, with_vector=with_vectors)
+    return models.QueryRequest(query=query_vector, filter=search_filter, params=provisioning.search_params(),
+                               limit=k, with_payload=True, with_vector=with_vectors)
+
+
+def hybrid_query(collection_name, query, query_vector, search_filter, k):
+    from qdrant_client import models
+
+    # Arguments for query_points that fuse dense and sparse search with reciprocal rank fusion
+    return {
+        "collection_name": collection_name,
+        "prefetch": [
+            models.Prefetch(
+                query=query_vector,
+                filter=search_filter,
+                params=provisioning.search_params(),
+                limit=max(hybrid_prefetch_limit, k),
+            ),
+            models.Prefetch(
+                query=sparse.query_vector(query),
+                using=sparse.SPARSE_VECTOR_NAME,
+                filter=search_filter,
+                limit=max(hybrid_prefetch_limit, k),
+            ),
+        ],
+        "query": models.FusionQuery(fusion=models.Fusion.RRF),
+        "query_filter": search_filter,
+        "limit": k,
+        "with_payload": True,
+    }
+
+
+def results_to_documents(results, with_vectors=False):
+    from langchain_core.documents import Document
+
     # Convert results to documents
     documents = []
     for result in results:
@@ -202,18 +944,110 @@ def retrieve_docs(db, query, company, k=4):
             page_content=result.payload['text'],
             metadata=result.payload['metadata']
         )
-        documents.append((doc, result.score))
+        if with_vectors:
+            # Hybrid collections return every named vector; the dense one is the default ""
+            vector = result.vector[""] if isinstance(result.vector, dict) else result.vector
+            documents.append((doc, result.score, vector))
+        else:
+            documents.append((doc, result.score))
     
     return documents
 
 
-def question_pdf(question, documents):
-    # Extract just the documents from document-score tuples if they exist
-    if documents and isinstance(documents[0], tuple):
-        documents = [doc for doc, score in documents]
-    
-    context = "\n\n".join([doc.page_content for doc in documents])
-    prompt = ChatPromptTemplate.from_template(template)
-    chain = prompt | model
+def retrieve_context_docs(db, query, company, k=4, query_vector=None):
+    # MMR needs the query vector to score relevance, so embed once here and share it with the search
+    if query_vector is None:
+        query_vector = embed_question(query, company)
+    # Fetch extra candidates with their vectors and keep the k most relevant, non-redundant ones
+    candidates = retrieve_docs(db, query, company, k=k * context_assembly.mmr_candidates_per_result,
+                               query_vector=query_vector, with_vectors=True)
+    with tracing.span("mmr", company):
+        return [(doc, score) for doc, score, _ in context_assembly.select_mmr(candidates, k, query_vector)]
+
+
+def build_chain_input(question, documents, k=None):
+    # Merge overlapping chunks, drop near-duplicates and keep the context within the token budget
+    with tracing.span("assemble_context"):
+        context, _ = context_assembly.assemble_context(documents, k=k)
+    return {"question": question, "context": context}
+
+
+def question_pdf(question, documents, priority=generation.INTERACTIVE):
+    chain_input = build_chain_input(question, documents)
+    return generation_manager.invoke(chain_input, priority=priority)
+
+
+def question_pdf_stream(question, documents, priority=generation.INTERACTIVE):
+    # Yield tokens as the model produces them and record how long the first one took (including any queueing)
+    chain_input = build_chain_input(question, documents)
+    started = time.perf_counter()
+    first_token = True
+    for token in generation_manager.stream(chain_input, priority=priority):
+        if first_token:
+            metrics.observe("llm_time_to_first_token_seconds", time.perf_counter() - started)
+            tracing.record_stage("llm_first_token", time.perf_counter() - started)
+            first_token = False
+        yield token
+    metrics.observe("llm_generation_seconds", time.perf_counter() - started)
+    tracing.record_stage("llm", time.perf_counter() - started)
+
+
+def answer_question(db, question, company, k=4, priority=generation.INTERACTIVE):
+    with tracing.trace_request("answer_question", company):
+        # Embed the question once and reuse it for both the cache lookup and the search
+        query_vector = embed_question(question, company)
+
+        with tracing.span("answer_cache", company):
+            cached = answer_cache.lookup(company, query_vector)
+        if cached:
+            print(f"Answer cache hit for {company} (similarity {cached['similarity']:.3f} to: {cached['question']})")
+            return cached["answer"], cached["documents"], True
+
+        related_documents = retrieve_context_docs(db, question, company, k=k, query_vector=query_vector)
+        if not related_documents:
+            return None, related_documents, False
+
+        answer = question_pdf(question, related_documents, priority=priority)
+        answer_cache.store(company, question, query_vector, answer, related_documents)
+        return answer, related_documents, False
+
+
+def answer_question_stream(db, question, company, k=4, priority=generation.INTERACTIVE):
+    # Same as answer_question, but the answer comes back as an iterator of tokens. The request stays open
+    # until the tokens have all been read, so slow streamed answers reach the slow request log too
+    request = tracing.trace_request("answer_question", company)
+    request.__enter__()
+    try:
+        tokens, related_documents, from_cache = start_answer_stream(db, question, company, k, priority)
+    except BaseException as e:
+        request.__exit__(type(e), e, e.__traceback__)
+        raise
+    return tracing.end_request_after(request, tokens), related_documents, from_cache
+
+
+def start_answer_stream(db, question, company, k, priority):
+    query_vector = embed_question(question, company)
+
+    with tracing.span("answer_cache", company):
+        cached = answer_cache.lookup(company, query_vector)
+    if cached:
+        return iter([cached["answer"]]), cached["documents"], True
+
+    related_documents = retrieve_context_docs(db, question, company, k=k, query_vector=query_vector)
+    if not related_documents:
+        return iter([]), related_documents, False
+
+    def tokens():
+        parts = []
+        for token in question_pdf_stream(question, related_documents, priority=priority):
+            parts.append(token)
+            yield token
+
+        # Only complete answers are cached
+        answer_cache.store(company, question, query_vector, "".join(parts), related_documents)
+
+    return tokens(), related_documents, False
+
 
-    return chain.invoke({"question": question, "context": context})
\ No newline at end of file
+# How long importing this module took, the part of start up every entry point pays
+metrics.set_gauge("main_import_seconds", time.perf_counter() - import_started)
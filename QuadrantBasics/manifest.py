@@ -0,0 +1,147 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+
+def company_slug(company):
+    """Turn a company name into a safe file name"""
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", company).strip("_") or "company"
+
+
+class FileManifest:
+    """Per-company record of every ingested file, keyed by content hash, in a SQLite file shared by all processes"""
+
+    def __init__(self, directory="manifests"):
+        self.directory = directory
+        self.path = os.path.join(directory, "manifest.sqlite3")
+        self._lock = threading.Lock()
+        self._db = None
+        self._migrated = set()
+
+    def _connect(self):
+        # Opened on first use so importing main.py never touches the disk; called with the lock held
+        if self._db is None:
+            os.makedirs(self.directory, exist_ok=True)
+            # One connection shared by every thread, guarded by the lock; other processes wait on SQLite's own lock
+            self._db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS files (company TEXT NOT NULL, file_hash TEXT NOT NULL, "
+                "file_name TEXT NOT NULL, chunk_count INTEGER NOT NULL, bytes INTEGER NOT NULL, "
+                "ingested_at REAL NOT NULL, PRIMARY KEY (company, file_hash))"
+            )
+            self._db.execute("CREATE TABLE IF NOT EXISTS versions (company TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+            self._db.commit()
+        return self._db
+
+    def _company_db(self, company):
+        db = self._connect()
+        if company not in self._migrated:
+            self._migrate_json(db, company)
+            self._migrated.add(company)
+        return db
+
+    def _migrate_json(self, db, company):
+        # Manifests used to be one JSON file per company; fold an old one in the first time the company is used
+        path = os.path.join(self.directory, company_slug(company) + ".json")
+        try:
+            with open(path, "r") as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            print(f"Error loading manifest for {company}: {str(e)}")
+            return
+        with db:
+            db.executemany(
+                "INSERT OR IGNORE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                [(company, entry["file_hash"], entry["file_name"], entry["chunk_count"], entry["bytes"],
+                  entry["ingested_at"]) for entry in entries.values()],
+            )
+            self._bump(db, company)
+        try:
+            os.replace(path, path + ".migrated")
+        except FileNotFoundError:
+            pass  # another process migrated it at the same time
+
+    @staticmethod
+    def _bump(db, company):
+        db.execute("INSERT INTO versions VALUES (?, 1) ON CONFLICT (company) DO UPDATE SET version = version + 1",
+                   (company,))
+
+    @staticmethod
+    def _entry(row):
+        file_hash, file_name, chunk_count, size_bytes, ingested_at = row
+        return {"file_name": file_name, "file_hash": file_hash, "chunk_count": chunk_count, "bytes": size_bytes,
+                "ingested_at": ingested_at}
+
+    def version(self, company):
+        """Counter that changes whenever any process records or removes a file for the company"""
+        with self._lock:
+            row = self._company_db(company).execute(
+                "SELECT version FROM versions WHERE company = ?", (company,)).fetchone()
+        return row[0] if row else None
+
+    def get(self, company, file_hash):
+        """Return the manifest entry for a file hash, or None"""
+        with self._lock:
+            row = self._company_db(company).execute(
+                "SELECT file_hash, file_name, chunk_count, bytes, ingested_at FROM files "
+                "WHERE company = ? AND file_hash = ?", (company, file_hash)).fetchone()
+        return self._entry(row) if row else None
+
+    def files(self, company):
+        """Return every manifest entry for a company"""
+        with self._lock:
+            rows = self._company_db(company).execute(
+                "SELECT file_hash, file_name, chunk_count, bytes, ingested_at FROM files WHERE company = ? "
+                "ORDER BY ingested_at", (company,)).fetchall()
+        return [self._entry(row) for row in rows]
+
+    def record(self, company, file_hash, file_name, chunk_count, size_bytes):
+        with self._lock:
+            db = self._company_db(company)
+            with db:
+                db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                           (company, file_hash, file_name, chunk_count, size_bytes, time.time()))
+                self._bump(db, company)
+
+    def remove(self, company, file_hash):
+        with self._lock:
+            db = self._company_db(company)
+            with db:
+                if db.execute("DELETE FROM files WHERE company = ? AND file_hash = ?",
+                              (company, file_hash)).rowcount:
+                    self._bump(db, company)
+
+    def touch(self, company):
+        """Move the company's version on without recording a file, e.g. after points are imported directly"""
+        with self._lock:
+            db = self._company_db(company)
+            with db:
+                self._bump(db, company)
+
+    def clear(self, company):
+        """Forget every file for a company, e.g. when its collection is recreated"""
+        with self._lock:
+            db = self._company_db(company)
+            with db:
+                db.execute("DELETE FROM files WHERE company = ?", (company,))
+                self._bump(db, company)
+
+    def clear_all(self):
+        """Forget every company's files, e.g. when the shared collection they all live in is recreated"""
+        with self._lock:
+            db = self._connect()
+            with db:
+                db.execute("INSERT OR IGNORE INTO versions (company, version) SELECT DISTINCT company, 0 FROM files")
+                db.execute("DELETE FROM files")
+                db.execute("UPDATE versions SET version = version + 1")
+            # Old JSON manifests describe the collection that was just replaced
+            if os.path.isdir(self.directory):
+                for name in os.listdir(self.directory):
+                    if name.endswith(".json"):
+                        os.remove(os.path.join(self.directory, name))
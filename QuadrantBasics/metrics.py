@@ -0,0 +1,81 @@
+import threading
+from collections import defaultdict, deque
+
+
+def percentile(values, fraction):
+    """Return the value at the given fraction (0-1) of a list using nearest-rank"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+class Metrics:
+    """Thread-safe in-process counters, gauges and latency samples"""
+
+    def __init__(self, max_samples=1000):
+        self.max_samples = max_samples
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+        self._gauges = {}
+        self._samples = {}
+        self._mirrors = []
+
+    def add_mirror(self, mirror):
+        """Forward every future increment/set_gauge/observe to mirror, e.g. a Prometheus exporter"""
+        self._mirrors.append(mirror)
+
+    def increment(self, name, amount=1, **labels):
+        with self._lock:
+            self._counters[_key(name, labels)] += amount
+        for mirror in self._mirrors:
+            mirror.increment(name, amount, **labels)
+
+    def set_gauge(self, name, value, **labels):
+        with self._lock:
+            self._gauges[_key(name, labels)] = value
+        for mirror in self._mirrors:
+            mirror.set_gauge(name, value, **labels)
+
+    def observe(self, name, value, **labels):
+        # Only the most recent samples are kept so memory stays bounded on long running bots
+        with self._lock:
+            key = _key(name, labels)
+            if key not in self._samples:
+                self._samples[key] = deque(maxlen=self.max_samples)
+            self._samples[key].append(value)
+        for mirror in self._mirrors:
+            mirror.observe(name, value, **labels)
+
+    def summary(self):
+        """Return a plain dict snapshot with p50/p95/p99 for every latency series"""
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            samples = {key: list(values) for key, values in self._samples.items()}
+
+        def label(key):
+            name, labels = key
+            return name + ("{" + ",".join(f"{k}={v}" for k, v in labels) + "}" if labels else "")
+
+        return {
+            "counters": {label(key): value for key, value in counters.items()},
+            "gauges": {label(key): value for key, value in gauges.items()},
+            "latencies": {
+                label(key): {
+                    "count": len(values),
+                    "p50": percentile(values, 0.50),
+                    "p95": percentile(values, 0.95),
+                    "p99": percentile(values, 0.99),
+                }
+                for key, values in samples.items()
+            },
+        }
+
+
+# Shared by the bot, the Streamlit pages and main.py
+metrics = Metrics()
@@ -0,0 +1,123 @@
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import main
+import provisioning
+import sparse
+
+
+def source_collections(client, shared_name):
+    """Every per-company collection, i.e. all collections except the shared one"""
+    return sorted(c.name for c in client.get_collections().collections if c.name != shared_name)
+
+
+def dense_size(client, collection_name):
+    vectors = client.get_collection(collection_name).config.params.vectors
+    return (vectors[""] if isinstance(vectors, dict) else vectors).size
+
+
+def to_shared_point(point, company, hybrid):
+    """Copy a stored point for the shared collection; vectors are reused, never re-embedded"""
+    from qdrant_client import models
+
+    payload = dict(point.payload or {})
+    # Older points may not carry the company; the shared collection can't tell companies apart without it
+    payload["metadata"] = {**(payload.get("metadata") or {}), "company": company}
+
+    vectors = point.vector if isinstance(point.vector, dict) else {"": point.vector}
+    if hybrid:
+        # The lexical vector is cheap to rebuild from the stored text if the source collection had none
+        vector = {"": vectors[""], sparse.SPARSE_VECTOR_NAME:
+                  vectors.get(sparse.SPARSE_VECTOR_NAME) or sparse.document_vector(payload.get("text", ""))}
+    else:
+        vector = vectors[""]
+    return models.PointStruct(id=point.id, vector=vector, payload=payload)
+
+
+def migrate_company(client, company, shared_name, hybrid, batch_size=256, max_pending=2, delete_source=False):
+    """Stream one company's collection into the shared collection and check the counts match"""
+    from qdrant_client import models
+
+    started = time.perf_counter()
+    source_count = client.count(collection_name=company, exact=True).count
+    copied = 0
+    offset = None
+    pending = []
+
+    # Point IDs already include the company, so they can't collide in the shared collection and a
+    # re-run simply overwrites what an interrupted run copied
+    with ThreadPoolExecutor(max_workers=1) as upsert_pool:
+        while True:
+            points, offset = client.scroll(
+                collection_name=company,
+                limit=batch_size,
+                offset=offset,
+                with_payload=True,
+                with_vectors=True,
+            )
+            if points:
+                while len(pending) >= max_pending:
+                    pending.pop(0).result()
+                batch = [to_shared_point(point, company, hybrid) for point in points]
+                pending.append(upsert_pool.submit(client.upsert, collection_name=shared_name, points=batch))
+                copied += len(points)
+                print(f"[{company}] {copied}/{source_count} points")
+            if offset is None:
+                break
+        for future in pending:
+            future.result()
+
+    shared_count = client.count(
+        collection_name=shared_name,
+        count_filter=models.Filter(must=[models.FieldCondition(key="metadata.company",
+                                                               match=models.MatchValue(value=company))]),
+        exact=True,
+    ).count
+    if shared_count < source_count:
+        raise RuntimeError(f"{company}: only {shared_count} of {source_count} points are in {shared_name}")
+
+    if delete_source:
+        client.delete_collection(company)
+        print(f"[{company}] deleted source collection")
+    print(f"[{company}] migrated {copied} points in {time.perf_counter() - started:.1f}s")
+    return copied
+
+
+def cli():
+    parser = argparse.ArgumentParser(
+        description="Copy per-company collections into the shared multi-tenant collection without re-embedding"
+    )
+    parser.add_argument("companies", nargs="*", help="Companies to migrate (default: every other collection)")
+    parser.add_argument("--shared-collection", default=main.shared_collection_name)
+    parser.add_argument("--hybrid", action="store_true", help="Create the shared collection with sparse vectors")
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--delete-source", action="store_true",
+                        help="Delete each company's collection once its points are verified in the shared one")
+    args = parser.parse_args()
+
+    client = main.qdrant_client
+    companies = args.companies or source_collections(client, args.shared_collection)
+    if not companies:
+        print("Nothing to migrate")
+        return
+
+    # The shared collection has to match the vectors being copied, so take the size from the first source
+    dimension = dense_size(client, companies[0])
+    provisioning.ensure_collection(client, args.shared_collection, dimension, hybrid=args.hybrid, shared=True)
+    hybrid = provisioning.has_sparse_vector(client, args.shared_collection)
+
+    total = 0
+    for company in companies:
+        if dense_size(client, company) != dimension:
+            print(f"[{company}] skipped: {dense_size(client, company)} dimensional vectors, expected {dimension}")
+            continue
+        total += migrate_company(client, company, args.shared_collection, hybrid,
+                                 batch_size=args.batch_size, delete_source=args.delete_source)
+
+    print(f"Migrated {total} points from {len(companies)} collections into {args.shared_collection}. "
+          f"Set collection_layout = \"shared\" in main.py to serve from it.")
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,193 @@
+import sparse
+
+# Vector and index settings applied when a company collection is created or migrated.
+# qdrant_client is imported inside the functions because its models take over a second to import
+distance = "Cosine"
+vectors_on_disk = False
+payload_on_disk = True
+hnsw_m = 16
+hnsw_ef_construct = 128
+hnsw_on_disk = False
+
+# Search time HNSW beam width; higher is more accurate and slower
+search_hnsw_ef = 128
+
+# Optional int8 scalar quantization; search rescores the oversampled candidates with the original vectors
+scalar_quantization = False
+quantization_quantile = 0.99
+quantization_always_ram = True
+quantization_oversampling = 2.0
+
+# Payload fields every filter in main.py relies on; ingest_complete holds the hash of a completely stored file
+indexed_payload_fields = ["metadata.company", "metadata.file_name", "ingest_complete"]
+
+# In a collection shared by many companies this field is indexed as the tenant, so Qdrant keeps each
+# company's points together and builds a small HNSW graph per company instead of one global graph
+tenant_field = "metadata.company"
+
+
+def check_embedding_model(client, collection_name, model_id):
+    """Raise if the collection's points were embedded by a different model than the current one"""
+    points, _ = client.scroll(
+        collection_name=collection_name,
+        limit=1,
+        with_payload=["metadata.embedding_model"],
+        with_vectors=False,
+    )
+    if not points:
+        return
+    stored = (points[0].payload.get("metadata") or {}).get("embedding_model")
+    if stored is None:
+        print(f"Collection {collection_name} doesn't record its embedding model; assuming {model_id}")
+    elif stored != model_id:
+        raise ValueError(
+            f"Collection {collection_name} was embedded with {stored} but the current embedding model is "
+            f"{model_id}; re-ingest it or switch the embedding backend back"
+        )
+
+
+def quantization_config():
+    from qdrant_client import models
+
+    if not scalar_quantization:
+        return None
+    return models.ScalarQuantization(
+        scalar=models.ScalarQuantizationConfig(
+            type=models.ScalarType.INT8,
+            quantile=quantization_quantile,
+            always_ram=quantization_always_ram,
+        )
+    )
+
+
+def hnsw_config(shared=False):
+    from qdrant_client import models
+
+    if shared:
+        # m=0 skips the global graph; payload_m builds one per tenant, since every search filters on a company
+        return models.HnswConfigDiff(m=0, payload_m=hnsw_m, ef_construct=hnsw_ef_construct, on_disk=hnsw_on_disk)
+    return models.HnswConfigDiff(m=hnsw_m, ef_construct=hnsw_ef_construct, on_disk=hnsw_on_disk)
+
+
+def payload_index_schema(field_name, shared=False):
+    from qdrant_client import models
+
+    if shared and field_name == tenant_field:
+        return models.KeywordIndexParams(type=models.KeywordIndexType.KEYWORD, is_tenant=True)
+    return models.PayloadSchemaType.KEYWORD
+
+
+def is_tenant_index(index_info):
+    params = getattr(index_info, "params", None)
+    return bool(getattr(params, "is_tenant", False))
+
+
+def search_params():
+    """Search parameters matching the collection settings, with rescoring when quantization is on"""
+    from qdrant_client import models
+
+    return models.SearchParams(
+        hnsw_ef=search_hnsw_ef,
+        quantization=models.QuantizationSearchParams(
+            rescore=True,
+            oversampling=quantization_oversampling,
+        ) if scalar_quantization else None,
+    )
+
+
+def ensure_payload_indexes(client, collection_name, payload_schema=None, shared=False):
+    """Create keyword indexes for the filtered payload fields that don't have one yet"""
+    if payload_schema is None:
+        payload_schema = client.get_collection(collection_name).payload_schema or {}
+    for field_name in indexed_payload_fields:
+        # A shared collection's company index must be a tenant index; creating it again replaces a plain one
+        needs_tenant = shared and field_name == tenant_field and field_name in payload_schema \
+            and not is_tenant_index(payload_schema[field_name])
+        if field_name not in payload_schema or needs_tenant:
+            print(f"Creating {'tenant' if shared and field_name == tenant_field else 'payload'} index on "
+                  f"{field_name} for {collection_name}")
+            client.create_payload_index(
+                collection_name=collection_name,
+                field_name=field_name,
+                field_schema=payload_index_schema(field_name, shared),
+                wait=True,
+            )
+
+
+def has_sparse_vector(client, collection_name):
+    """Return True if the collection stores the lexical sparse vector used by hybrid search"""
+    sparse_vectors = client.get_collection(collection_name).config.params.sparse_vectors or {}
+    return sparse.SPARSE_VECTOR_NAME in sparse_vectors
+
+
+def create_collection(client, collection_name, dimension, hybrid=False, shared=False):
+    from qdrant_client import models
+
+    print(f"Creating collection {collection_name} with {dimension} dimensional vectors"
+          f"{' and sparse lexical vectors' if hybrid else ''}")
+    client.create_collection(
+        collection_name=collection_name,
+        vectors_config=models.VectorParams(size=dimension, distance=distance, on_disk=vectors_on_disk),
+        sparse_vectors_config=sparse.sparse_vectors_config() if hybrid else None,
+        hnsw_config=hnsw_config(shared),
+        quantization_config=quantization_config(),
+        on_disk_payload=payload_on_disk,
+    )
+    ensure_payload_indexes(client, collection_name, payload_schema={}, shared=shared)
+
+
+def migrate_collection(client, collection_name, dimension, shared=False):
+    """Bring an existing collection up to the current settings without touching its points"""
+    from qdrant_client import models
+
+    info = client.get_collection(collection_name)
+    params = info.config.params
+    vectors = params.vectors
+
+    # Collections created by QdrantVectorStore.from_documents use a single unnamed vector
+    if isinstance(vectors, dict):
+        if "" not in vectors:
+            raise ValueError(f"Collection {collection_name} has no default vector: {sorted(vectors)}")
+        vectors = vectors[""]
+    if vectors.size != dimension:
+        raise ValueError(
+            f"Collection {collection_name} stores {vectors.size} dimensional vectors "
+            f"but the embedding model produces {dimension}"
+        )
+
+    # Only send an update when something actually differs, since updates can trigger re-indexing
+    hnsw = info.config.hnsw_config
+    wanted_hnsw = hnsw_config(shared)
+    wanted_quantization = quantization_config()
+    changes = {}
+    if (hnsw.m, hnsw.payload_m if shared else None, hnsw.ef_construct, bool(hnsw.on_disk)) != \
+            (wanted_hnsw.m, wanted_hnsw.payload_m, wanted_hnsw.ef_construct, wanted_hnsw.on_disk):
+        changes["hnsw_config"] = wanted_hnsw
+    if bool(vectors.on_disk) != vectors_on_disk:
+        changes["vectors_config"] = {"": models.VectorParamsDiff(on_disk=vectors_on_disk)}
+    if (info.config.quantization_config is None) != (wanted_quantization is None):
+        changes["quantization_config"] = wanted_quantization or models.Disabled.DISABLED
+    if bool(params.on_disk_payload) != payload_on_disk:
+        changes["collection_params"] = models.CollectionParamsDiff(on_disk_payload=payload_on_disk)
+    if changes:
+        print(f"Migrating collection {collection_name}: {', '.join(changes)}")
+        client.update_collection(collection_name=collection_name, **changes)
+
+    ensure_payload_indexes(client, collection_name, info.payload_schema or {}, shared=shared)
+
+
+def ensure_collection(client, collection_name, dimension, hybrid=False, shared=False):
+    """Create the collection if it is missing, otherwise migrate it; returns True if it was created.
+
+    shared=True sets the collection up for many companies (tenant index, per-tenant HNSW graphs).
+    """
+    if client.collection_exists(collection_name):
+        migrate_collection(client, collection_name, dimension, shared=shared)
+
+        # Qdrant can't add a new vector to an existing collection, so hybrid needs a fresh one
+        if hybrid and not has_sparse_vector(client, collection_name):
+            print(f"Collection {collection_name} has no sparse vectors; hybrid search needs it to be recreated "
+                  f"and re-ingested, using dense search until then")
+        return False
+    create_collection(client, collection_name, dimension, hybrid=hybrid, shared=shared)
+    return True
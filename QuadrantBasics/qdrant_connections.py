@@ -0,0 +1,190 @@
+import asyncio
+import random
+import threading
+import time
+from collections import OrderedDict
+
+# HTTP statuses worth retrying: rate limiting and server side failures
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# gRPC status names worth retrying
+RETRYABLE_GRPC_CODES = {"UNAVAILABLE", "DEADLINE_EXCEEDED", "RESOURCE_EXHAUSTED"}
+
+
+def is_transient(error):
+    """Return True for connection problems and overloaded-server responses that may succeed on retry"""
+    from qdrant_client.http.exceptions import ResponseHandlingException, UnexpectedResponse
+
+    if isinstance(error, ResponseHandlingException):
+        return True
+    if isinstance(error, UnexpectedResponse):
+        return error.status_code in RETRYABLE_STATUS_CODES
+    code = getattr(error, "code", None)
+    if callable(code):
+        try:
+            return code().name in RETRYABLE_GRPC_CODES
+        except Exception:
+            return False
+    return isinstance(error, (ConnectionError, TimeoutError))
+
+
+class RetryingClient:
+    """Proxy whose methods call the manager's current client with retries"""
+
+    def __init__(self, manager):
+        self._manager = manager
+
+    def __getattr__(self, name):
+        attribute = getattr(self._manager.client, name)
+        if not callable(attribute):
+            return attribute
+
+        def call(*args, **kwargs):
+            return self._manager.with_retry(lambda: getattr(self._manager.client, name)(*args, **kwargs))
+        return call
+
+
+class QdrantConnectionManager:
+    """Owns the process wide Qdrant clients and retries transient failures with backoff"""
+
+    def __init__(self, url, prefer_grpc=True, grpc_port=6334, timeout=30, max_retries=3, backoff_seconds=0.5,
+                 keep_alive_ms=30000):
+        self.url = url
+        self.prefer_grpc = prefer_grpc
+        self.grpc_port = grpc_port
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.keep_alive_ms = keep_alive_ms
+
+        self._client = None
+        self._async_client = None
+        self._lock = threading.Lock()
+        self.retrying = RetryingClient(self)
+
+    def _client_options(self):
+        return {
+            "url": self.url if "://" in self.url else f"http://{self.url}",
+            "prefer_grpc": self.prefer_grpc,
+            "grpc_port": self.grpc_port,
+            "timeout": self.timeout,
+            # Keep idle gRPC channels open so the first call after a quiet period doesn't reconnect
+            "grpc_options": {
+                "grpc.keepalive_time_ms": self.keep_alive_ms,
+                "grpc.keepalive_timeout_ms": 10000,
+                "grpc.keepalive_permit_without_calls": 1,
+            },
+        }
+
+    @property
+    def client(self):
+        """The shared QdrantClient, created on first use"""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    # Imported here so only processes that talk to Qdrant pay for the client
+                    from qdrant_client import QdrantClient
+                    self._client = QdrantClient(**self._client_options())
+        return self._client
+
+    @property
+    def async_client(self):
+        """The shared AsyncQdrantClient, created on first use; only await it on one event loop"""
+        if self._async_client is None:
+            with self._lock:
+                if self._async_client is None:
+                    from qdrant_client import AsyncQdrantClient
+                    self._async_client = AsyncQdrantClient(**self._client_options())
+        return self._async_client
+
+    def use_client(self, client, async_client=None):
+        """Replace the shared clients, e.g. with QdrantClient(":memory:") for benchmarks"""
+        with self._lock:
+            self._client = client
+            self._async_client = async_client
+
+    def backoff(self, attempt):
+        # Exponential backoff with jitter so many threads don't retry in lockstep
+        return self.backoff_seconds * (2 ** attempt) * (0.5 + random.random())
+
+    def with_retry(self, fn):
+        """Call fn(), retrying transient Qdrant errors up to max_retries times"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                return fn()
+            except Exception as e:
+                if attempt == self.max_retries or not is_transient(e):
+                    raise
+                delay = self.backoff(attempt)
+                print(f"Qdrant call failed ({str(e)}), retrying in {delay:.2f}s")
+                time.sleep(delay)
+
+    async def awith_retry(self, fn):
+        """Async version of with_retry; fn() must return an awaitable"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await fn()
+            except Exception as e:
+                if attempt == self.max_retries or not is_transient(e):
+                    raise
+                await asyncio.sleep(self.backoff(attempt))
+
+    def close(self):
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+            self._client = None
+
+
+class VectorStoreRegistry:
+    """Thread-safe, size-bounded LRU registry of vector stores keyed by company"""
+
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self._stores = OrderedDict()
+        self._lock = threading.Lock()
+        self._creating = {}
+
+    def get_or_create(self, key, factory):
+        """Return the store for key, building it with factory() at most once even across threads"""
+        with self._lock:
+            if key in self._stores:
+                self._stores.move_to_end(key)
+                return self._stores[key]
+            key_lock = self._creating.setdefault(key, threading.Lock())
+
+        with key_lock:
+            # Another thread may have finished creating it while we waited
+            with self._lock:
+                if key in self._stores:
+                    return self._stores[key]
+            store = factory()
+            with self._lock:
+                self._stores[key] = store
+                self._creating.pop(key, None)
+                while len(self._stores) > self.max_size:
+                    self._stores.popitem(last=False)
+            return store
+
+    def get(self, key, default=None):
+        with self._lock:
+            return self._stores.get(key, default)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._stores.pop(key, default)
+
+    def keys(self):
+        with self._lock:
+            return list(self._stores.keys())
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._stores
+
+    def __len__(self):
+        with self._lock:
+            return len(self._stores)
+
+    def __repr__(self):
+        return f"VectorStoreRegistry({self.keys()})"
@@ -0,0 +1,128 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from metrics import metrics
+import tracing
+
+
+class _Request:
+    __slots__ = ("text", "vector", "collection_name", "make_request", "future")
+
+    def __init__(self, text, vector, collection_name=None, make_request=None):
+        self.text = text
+        self.vector = vector
+        self.collection_name = collection_name
+        self.make_request = make_request
+        self.future = Future()
+
+
+class QueryBatcher:
+    """Coalesces queries that arrive within a short window into one embedding call and one Qdrant
+    batch query per collection, then hands each caller its own result.
+
+    embed_texts(texts) returns a vector per text; run_queries(collection_name, requests) runs a list of
+    Qdrant QueryRequests and returns a list of results per request.
+    """
+
+    def __init__(self, embed_texts, run_queries, window_seconds=0.005, max_batch_size=32, max_concurrent_batches=2):
+        self.embed_texts = embed_texts
+        self.run_queries = run_queries
+        self.window_seconds = window_seconds
+        self.max_batch_size = max_batch_size
+        self.max_concurrent_batches = max_concurrent_batches
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._pool = None
+        self._running = 0
+
+    def embed(self, text):
+        """Embed one query as part of the next batch"""
+        return self._submit(_Request(text, None))
+
+    def search(self, collection_name, text, make_request, query_vector=None):
+        """Embed text (unless query_vector is given) and run make_request(vector) in the next batch query.
+
+        Returns the query's results.
+        """
+        return self._submit(_Request(text, query_vector, collection_name, make_request))
+
+    def _submit(self, request):
+        self._start()
+        self._queue.put(request)
+        return request.future.result()
+
+    def _start(self):
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=self.max_concurrent_batches,
+                                                    thread_name_prefix="query-batch")
+                    threading.Thread(target=self._collect, name="query-batcher", daemon=True).start()
+
+    def _collect(self):
+        while True:
+            # Block for the first request, then take whatever else arrives within the window. A lone
+            # query on an idle batcher goes straight away rather than paying the window for nothing.
+            batch = [self._queue.get()]
+            idle = self._running == 0 and self._queue.empty()
+            deadline = time.perf_counter() + (0 if idle else self.window_seconds)
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            # While this batch runs, the next one keeps collecting, so batches grow with load
+            with self._lock:
+                self._running += 1
+            self._pool.submit(self._run, batch)
+
+    def _run(self, batch):
+        try:
+            self._run_batch(batch)
+        finally:
+            with self._lock:
+                self._running -= 1
+
+    def _run_batch(self, batch):
+        metrics.observe("query_batch_size", len(batch))
+        try:
+            self._embed(batch)
+        except Exception as e:
+            for request in batch:
+                request.future.set_exception(e)
+            return
+
+        groups = {}
+        for request in batch:
+            if request.make_request is None:
+                request.future.set_result(request.vector)
+            else:
+                groups.setdefault(request.collection_name, []).append(request)
+
+        # One round trip per collection; a failure only affects the queries against that collection
+        for collection_name, requests in groups.items():
+            try:
+                with tracing.span("qdrant_batch_search"):
+                    results = self.run_queries(collection_name, [r.make_request(r.vector) for r in requests])
+                for request, result in zip(requests, results):
+                    request.future.set_result(result)
+            except Exception as e:
+                for request in requests:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+
+    def _embed(self, batch):
+        # The same question asked twice at once is only embedded once
+        texts = list(dict.fromkeys(request.text for request in batch if request.vector is None))
+        if not texts:
+            return
+        with tracing.span("embed_query_batch"):
+            vectors = dict(zip(texts, self.embed_texts(texts)))
+        for request in batch:
+            if request.vector is None:
+                request.vector = vectors[request.text]
@@ -1,169 +1,249 @@
 import os
 import json
+import time
+import threading
+
+# Measured from here so the start up time printed below includes importing everything else
+startup_started = time.perf_counter()
+
 from dotenv import load_dotenv
 from slack_bolt import App
 from slack_bolt.adapter.socket_mode import SocketModeHandler
-from main import create_qdrant_database, retrieve_docs, question_pdf, retrieve_doc_by_metadata
+from main import create_qdrant_database, answer_question_stream, retrieve_doc_by_metadata, preload
+from metrics import metrics
+import tracing
+from slack_workers import ChannelWorkerPool, EventDeduplicator
 
 # Load environment variables from .env file
 load_dotenv()
 
 # Constants
 MAPPING_FILE = "channel_mappings.json"
+WORKER_COUNT = int(os.environ.get("SLACK_WORKER_COUNT", "4"))
+MAX_PENDING_QUESTIONS = int(os.environ.get("SLACK_MAX_PENDING_QUESTIONS", "100"))
+# Minimum seconds between chat_update calls while an answer streams in, to stay under Slack's rate limits
+STREAM_UPDATE_INTERVAL = float(os.environ.get("SLACK_STREAM_UPDATE_INTERVAL", "1.5"))
 
-def load_channel_mappings():
+def load_channel_mappings(path=MAPPING_FILE):
     """Load channel to company mappings from JSON file"""
     try:
-        if os.path.exists(MAPPING_FILE):
-            with open(MAPPING_FILE, 'r') as f:
+        if os.path.exists(path):
+            with open(path, 'r') as f:
                 return json.load(f)
         return {}
     except Exception as e:
         print(f"Error loading channel mappings: {str(e)}")
         return {}
 
-def save_channel_mappings(mappings):
+def save_channel_mappings(mappings, path=MAPPING_FILE):
     """Save channel to company mappings to JSON file"""
     try:
-        with open(MAPPING_FILE, 'w') as f:
+        with open(path, 'w') as f:
             json.dump(mappings, f, indent=2)
-        print(f"Channel mappings saved to {MAPPING_FILE}")
+        print(f"Channel mappings saved to {path}")
     except Exception as e:
         print(f"Error saving channel mappings: {str(e)}")
 
-# Initialize the Slack app with your bot token and signing secret
-app = App(
-    token=os.environ.get("SLACK_BOT_TOKEN"),
-    signing_secret=os.environ.get("SLACK_SIGNING_SECRET")
-)
-
-# Load existing channel mappings from file
-channel_company_mapping = load_channel_mappings()
-print(f"Loaded channel mappings: {channel_company_mapping}")
-
 def extract_message_text(body):
     """Extract the actual message text without the bot mention"""
     text = body["event"].get("text", "")
     # Remove the bot user ID from the message (format: <@BOTID> message)
     return text.split(">", 1)[1].strip() if ">" in text else text.strip()
 
-@app.event("app_mention")
-def handle_mentions(body, logger):
-    try:
-        # Get the channel ID and message text
-        channel_id = body["event"]["channel"]
-        user_id = body["event"].get("user", "")
-        message_text = extract_message_text(body)
-        
-        # Debug information
-        print(f"\nReceived mention in channel: {channel_id}")
-        print(f"Message text (without mention): {message_text}")
-        print(f"From user: {user_id}")
-        print(f"Current channel mappings: {channel_company_mapping}")
-        print(f"Full event body: {body}")
-        
-        # Check if this is a set company command
-        if message_text.lower().startswith("set company"):
-            try:
-                # Extract company name from message
-                company_name = message_text[11:].strip()  # Remove "set company" and whitespace
-                print(f"Attempting to set company to: {company_name}")
-                
-                # Validate company name
-                if company_name not in ["Company A", "Company B", "Company C"]:
-                    print(f"Invalid company name: {company_name}")
-                    app.client.chat_postMessage(
-                        channel=channel_id,
-                        text="Invalid company name. Please use one of: Company A, Company B, Company C\nExample: @YourBot set company Company A"
-                    )
-                    return
-                
-                # Try to initialize the database to verify it works
-                try:
-                    db = create_qdrant_database(company_name)
-                    if not db:
-                        raise Exception("Failed to create or connect to database")
-                except Exception as e:
-                    print(f"Database initialization error: {str(e)}")
-                    app.client.chat_postMessage(
-                        channel=channel_id,
-                        text="Error connecting to company database. Please try again later."
-                    )
-                    return
-                
-                # Update the channel-company mapping
-                channel_company_mapping[channel_id] = company_name
-                # Save the updated mappings to file
-                save_channel_mappings(channel_company_mapping)
-                print(f"Updated channel mapping. New mappings: {channel_company_mapping}")
-                
-                app.client.chat_postMessage(
-                    channel=channel_id,
-                    text=f"✅ This channel has been associated with {company_name}"
-                )
-                return
-                
-            except Exception as e:
-                logger.error(f"Error setting company: {str(e)}")
-                print(f"Error in set company: {str(e)}")
-                app.client.chat_postMessage(
-                    channel=channel_id,
-                    text="Error setting company. Please try again later."
-                )
-                return
-        
-        # Handle regular questions
-        # Check if channel is mapped to a company
-        if channel_id not in channel_company_mapping:
-            print(f"Channel {channel_id} not mapped to any company")
-            app.client.chat_postMessage(
-                channel=channel_id,
-                text="This channel is not associated with any company yet. Use '@YourBot set company [Company Name]' to set up the integration.\nExample: @YourBot set company Company A"
-            )
-            return
-        
-        # Get the company associated with this channel
-        company = channel_company_mapping[channel_id]
-        print(f"Processing question for company: {company}")
-        
+class SlackBot:
+    """Answers app_mention events; the Slack client, channel mappings and limits are passed in rather
+    than read at import time, so the handler can also be driven offline (see slack_replay.py)"""
+
+    def __init__(self, client, channel_company_mapping=None, mapping_file=MAPPING_FILE, worker_count=WORKER_COUNT,
+                 max_pending=MAX_PENDING_QUESTIONS, stream_update_interval=STREAM_UPDATE_INTERVAL):
+        self.client = client
+        self.channel_company_mapping = channel_company_mapping if channel_company_mapping is not None else {}
+        # None keeps "set company" changes in memory only
+        self.mapping_file = mapping_file
+        self.stream_update_interval = stream_update_interval
+
+        # Questions are answered on a bounded pool so the listener returns (and Slack is acked) straight away
+        self.worker_pool = ChannelWorkerPool(max_workers=worker_count, max_pending=max_pending)
+
+        # Slack re-delivers events it thinks timed out, so remember which ones were already taken
+        self.event_deduplicator = EventDeduplicator()
+
+    def save_mappings(self):
+        if self.mapping_file:
+            save_channel_mappings(self.channel_company_mapping, self.mapping_file)
+
+    def post_answer_stream(self, channel_id, ts, tokens, received_at):
+        """Update a posted message with streamed tokens, at most once per stream_update_interval"""
+        answer = ""
+        last_update = time.perf_counter()
+        for token in tokens:
+            if not answer:
+                metrics.observe("slack_time_to_first_token_seconds", time.perf_counter() - received_at)
+            answer += token
+            if time.perf_counter() - last_update >= self.stream_update_interval:
+                with tracing.span("slack_api"):
+                    self.client.chat_update(channel=channel_id, ts=ts, text=f"Here's what I found:\n{answer}")
+                last_update = time.perf_counter()
+
+        # Always finish with the complete answer
+        with tracing.span("slack_api"):
+            self.client.chat_update(channel=channel_id, ts=ts, text=f"Here's what I found:\n{answer}")
+
+    def answer_in_channel(self, channel_id, company, message_text, received_at, logger, event_id=None):
+        """Retrieve documents and answer a question, then post the reply to the channel"""
+        with tracing.trace_request("slack_answer", company, channel=channel_id, question=message_text,
+                                   event_id=event_id):
+            # Time between Slack delivering the event and a worker picking the question up
+            tracing.record_stage("slack_queue_wait", time.perf_counter() - received_at)
+            self.answer_question_in_channel(channel_id, company, message_text, received_at, logger)
+
+    def answer_question_in_channel(self, channel_id, company, message_text, received_at, logger):
         try:
             # Initialize the vector database for the company
             db = create_qdrant_database(company)
             if not db:
                 raise Exception("Failed to connect to database")
-            
-            # Search for relevant documents
+
+            # Search for relevant documents and generate an answer, or reuse one for a similar question
             print(f"Searching for documents related to: {message_text}")
-            related_documents = retrieve_docs(db, message_text, company)
-            
+            tokens, related_documents, from_cache = answer_question_stream(db, message_text, company)
+
             if not related_documents:
                 print("No relevant documents found")
-                app.client.chat_postMessage(
+                with tracing.span("slack_api"):
+                    self.client.chat_postMessage(
+                        channel=channel_id,
+                        text=f"I couldn't find any relevant information in {company}'s documents to answer your question."
+                    )
+                return
+
+            print(f"Found {len(related_documents)} relevant documents (cached answer: {from_cache})")
+
+            # Post one message and keep editing it as the answer streams in
+            with tracing.span("slack_api"):
+                response = self.client.chat_postMessage(
                     channel=channel_id,
-                    text=f"I couldn't find any relevant information in {company}'s documents to answer your question."
+                    text="Here's what I found:\n_thinking..._"
                 )
-                return
-            
-            print(f"Found {len(related_documents)} relevant documents")
-            # Generate answer using the question_pdf function
-            answer = question_pdf(message_text, related_documents)
-            
-            # Send the response back to Slack
-            app.client.chat_postMessage(
-                channel=channel_id,
-                text=f"Here's what I found:\n{answer}"
-            )
-            
+            self.post_answer_stream(channel_id, response["ts"], tokens, received_at)
+            metrics.observe("slack_time_to_answer_seconds", time.perf_counter() - received_at)
+
         except Exception as e:
             logger.error(f"Error processing message: {str(e)}")
             print(f"Error processing message: {str(e)}")
-            app.client.chat_postMessage(
+            metrics.increment("slack_answer_errors_total")
+            self.client.chat_postMessage(
                 channel=channel_id,
                 text="I encountered an error while processing your question. Please try again later."
             )
-    except Exception as e:
-        print(f"Error handling mention event: {str(e)}")
-        logger.error(f"Error handling mention event: {str(e)}")
+
+    def handle_mentions(self, body, logger):
+        try:
+            received_at = time.perf_counter()
+
+            # Ignore events Slack re-delivered because an earlier attempt looked slow
+            if self.event_deduplicator.seen(body.get("event_id"), body["event"].get("client_msg_id")):
+                print(f"Skipping duplicate event: {body.get('event_id')}")
+                metrics.increment("slack_duplicate_events_total")
+                return
+
+            # Get the channel ID and message text
+            channel_id = body["event"]["channel"]
+            user_id = body["event"].get("user", "")
+            message_text = extract_message_text(body)
+
+            # Debug information
+            print(f"\nReceived mention in channel: {channel_id}")
+            print(f"Message text (without mention): {message_text}")
+            print(f"From user: {user_id}")
+            print(f"Current channel mappings: {self.channel_company_mapping}")
+            print(f"Full event body: {body}")
+
+            # Check if this is a set company command
+            if message_text.lower().startswith("set company"):
+                try:
+                    # Extract company name from message
+                    company_name = message_text[11:].strip()  # Remove "set company" and whitespace
+                    print(f"Attempting to set company to: {company_name}")
+
+                    # Validate company name
+                    if company_name not in ["Company A", "Company B", "Company C"]:
+                        print(f"Invalid company name: {company_name}")
+                        self.client.chat_postMessage(
+                            channel=channel_id,
+                            text="Invalid company name. Please use one of: Company A, Company B, Company C\nExample: @YourBot set company Company A"
+                        )
+                        return
+
+                    # Try to initialize the database to verify it works
+                    try:
+                        db = create_qdrant_database(company_name)
+                        if not db:
+                            raise Exception("Failed to create or connect to database")
+                    except Exception as e:
+                        print(f"Database initialization error: {str(e)}")
+                        self.client.chat_postMessage(
+                            channel=channel_id,
+                            text="Error connecting to company database. Please try again later."
+                        )
+                        return
+
+                    # Update the channel-company mapping
+                    self.channel_company_mapping[channel_id] = company_name
+                    # Save the updated mappings to file
+                    self.save_mappings()
+                    print(f"Updated channel mapping. New mappings: {self.channel_company_mapping}")
+
+                    self.client.chat_postMessage(
+                        channel=channel_id,
+                        text=f"✅ This channel has been associated with {company_name}"
+                    )
+                    return
+
+                except Exception as e:
+                    logger.error(f"Error setting company: {str(e)}")
+                    print(f"Error in set company: {str(e)}")
+                    self.client.chat_postMessage(
+                        channel=channel_id,
+                        text="Error setting company. Please try again later."
+                    )
+                    return
+
+            # Handle regular questions
+            # Check if channel is mapped to a company
+            if channel_id not in self.channel_company_mapping:
+                print(f"Channel {channel_id} not mapped to any company")
+                self.client.chat_postMessage(
+                    channel=channel_id,
+                    text="This channel is not associated with any company yet. Use '@YourBot set company [Company Name]' to set up the integration.\nExample: @YourBot set company Company A"
+                )
+                return
+
+            # Get the company associated with this channel
+            company = self.channel_company_mapping[channel_id]
+            print(f"Processing question for company: {company}")
+
+            # Hand the question to the worker pool; each channel's questions are answered in order
+            position, busy = self.worker_pool.submit(
+                channel_id,
+                lambda: self.answer_in_channel(channel_id, company, message_text, received_at, logger,
+                                               event_id=body.get("event_id"))
+            )
+
+            if position is None:
+                print(f"Worker pool full, rejecting question from channel {channel_id}")
+                self.client.chat_postMessage(
+                    channel=channel_id,
+                    text="I'm handling too many questions right now. Please try again in a few minutes."
+                )
+            elif busy:
+                self.client.chat_postMessage(
+                    channel=channel_id,
+                    text=f"I'm busy right now, your question is queued at position {position}."
+                )
+        except Exception as e:
+            print(f"Error handling mention event: {str(e)}")
+            logger.error(f"Error handling mention event: {str(e)}")
 
 def verify_slack_connection(app_instance):
     try:
@@ -191,12 +271,35 @@ def main():
         raise ValueError("SLACK_SIGNING_SECRET not found in environment variables")
     
     print("\n=== Starting Slack Bot ===")
+
+    # Prometheus endpoint and OpenTelemetry spans, when METRICS_PORT / OTEL_TRACING are set
+    tracing.start_exporters()
     
+    # Initialize the Slack app with your bot token and signing secret
+    app = App(
+        token=os.environ.get("SLACK_BOT_TOKEN"),
+        signing_secret=os.environ.get("SLACK_SIGNING_SECRET")
+    )
+
+    # Load existing channel mappings from file
+    channel_company_mapping = load_channel_mappings()
+    print(f"Loaded channel mappings: {channel_company_mapping}")
+
+    bot = SlackBot(app.client, channel_company_mapping)
+    app.event("app_mention")(bot.handle_mentions)
+
     # Verify Slack connection
     if not verify_slack_connection(app):
         print("Failed to connect to Slack. Please check your tokens and permissions.")
         return
     
+    # Build the embedder, LLM and Qdrant clients in the background instead of on the first question
+    threading.Thread(target=preload, name="preload", daemon=True).start()
+
+    startup_seconds = time.perf_counter() - startup_started
+    metrics.set_gauge("startup_seconds", startup_seconds)
+    print(f"Started in {startup_seconds:.2f}s")
+
     print("\nAvailable commands:")
     print("  @YourBot set company [Company Name] - Associate the channel with a company")
     print("  @YourBot [your question] - Ask about company documents")
@@ -0,0 +1,270 @@
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import benchmark
+import main
+import slack_bot
+from fakes import FakeSlackClient, make_pdf, random_sentence
+from metrics import percentile
+
+COMPANIES = ["Company A", "Company B", "Company C"]
+
+# Replies are told apart by their text, exactly as a user in the channel would
+REPLY_KINDS = {
+    "answer": "Here's what I found:",
+    "error": "I encountered an error",
+    "rejected": "I'm handling too many questions",
+    "queued": "I'm busy right now",
+    "no_documents": "I couldn't find any relevant information",
+    "unmapped": "This channel is not associated",
+}
+
+
+def mention(event_id, channel, text, event_time=None):
+    """An app_mention event body shaped like the ones Slack delivers"""
+    return {
+        "event_id": event_id,
+        "event_time": event_time or int(time.time()),
+        "event": {
+            "type": "app_mention",
+            "channel": channel,
+            "user": "UREPLAY",
+            "text": f"<@UFAKEBOT> {text}",
+            "client_msg_id": str(uuid.uuid4()),
+        },
+    }
+
+
+def synthetic_events(count, channels, rng, redelivery_rate=0.0):
+    """Questions spread over the channels, with a share of them delivered twice as Slack does on retries"""
+    events = []
+    for i in range(count):
+        events.append(mention(f"EvReplay{i:06d}", rng.choice(channels), random_sentence(rng, words=8)))
+        if rng.random() < redelivery_rate:
+            events.append(events[-1])
+    return events
+
+
+def load_events(path):
+    """Read recorded event bodies, one JSON object per line (the body Slack posted, or just its event)"""
+    events = []
+    with open(path, "r") as f:
+        for number, line in enumerate(f):
+            if not line.strip():
+                continue
+            body = json.loads(line)
+            if "event" not in body:
+                body = {"event_id": f"EvRecorded{number:06d}", "event": body}
+            events.append(body)
+    return events
+
+
+def schedule(events, rate):
+    """Seconds after the start at which each event is delivered; rate 0 keeps recorded event_time spacing"""
+    if rate:
+        return [i / rate for i in range(len(events))]
+    times = [body.get("event_time") or 0 for body in events]
+    return [max(0, t - times[0]) for t in times]
+
+
+class ReplayBot(slack_bot.SlackBot):
+    """The real bot, tagging its replies with the event they answer and noting when each answer is complete"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._lock = threading.Lock()
+        self.delivered_at = {}
+        self.latencies = {}
+        self.finished_at = None
+
+    def deliver(self, body, logger, scheduled_at):
+        # Latency runs from when the event was due, so time spent waiting for a free listener thread counts too
+        with self._lock:
+            self.delivered_at.setdefault(body.get("event_id"), scheduled_at)
+        with self.client.tagged(event_id=body.get("event_id")):
+            self.handle_mentions(body, logger)
+
+    def answer_in_channel(self, channel_id, company, message_text, received_at, logger, event_id=None):
+        with self.client.tagged(event_id=event_id):
+            super().answer_in_channel(channel_id, company, message_text, received_at, logger, event_id=event_id)
+        with self._lock:
+            self.latencies.setdefault(event_id, time.perf_counter() - self.delivered_at.get(event_id, received_at))
+            self.finished_at = time.perf_counter()
+
+
+def prepare_companies(work_dir, companies, pages, seed):
+    # Each company gets its own generated manual so retrieval has something to find
+    for number, company in enumerate(companies):
+        db = main.create_qdrant_database(company)
+        main.add_documents_to_vector_db(db, make_pdf(os.path.join(work_dir, f"{number}.pdf"), pages, seed=seed + number),
+                                        company)
+
+
+def replay(bot, events, offsets, listener_threads=10, drain_timeout=300):
+    """Deliver each event at its offset through the real handler, then wait for the workers to finish"""
+    logger = logging.getLogger("slack_replay")
+    started = time.perf_counter()
+    # Bolt runs listeners on a thread pool of its own (10 threads by default)
+    with ThreadPoolExecutor(max_workers=listener_threads) as listeners:
+        for body, offset in zip(events, offsets):
+            delay = started + offset - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            listeners.submit(bot.deliver, body, logger, started + offset)
+    dispatched_at = time.perf_counter()
+
+    # Every accepted question has been handled once no worker has anything queued or running
+    deadline = time.perf_counter() + drain_timeout
+    while not bot.worker_pool.idle() and time.perf_counter() < deadline:
+        time.sleep(0.05)
+    return started, dispatched_at
+
+
+def reply_kind(text):
+    for kind, prefix in REPLY_KINDS.items():
+        if text.startswith(prefix):
+            return kind
+    return None
+
+
+def summarize(bot, client, events, started, dispatched_at):
+    replies = {kind: 0 for kind in REPLY_KINDS}
+    # Replies actually posted for each question; "busy" notices are followed by the real reply, so they don't count
+    posted = {}
+    for message in client.messages:
+        if message["method"] != "chat_postMessage":
+            continue
+        kind = reply_kind(message["text"])
+        if kind:
+            replies[kind] += 1
+        if kind != "queued" and message.get("event_id"):
+            posted[message["event_id"]] = posted.get(message["event_id"], 0) + 1
+
+    unique_events = len({body["event_id"] for body in events})
+    latencies = list(bot.latencies.values())
+    finished_at = bot.finished_at or dispatched_at
+    return {
+        "events_delivered": len(events),
+        "unique_events": unique_events,
+        "redeliveries": len(events) - unique_events,
+        "completed": len(bot.latencies),
+        "duplicate_replies": sum(count - 1 for count in posted.values()),
+        "replies": replies,
+        "error_rate": replies["error"] / unique_events if unique_events else 0.0,
+        "rejection_rate": replies["rejected"] / unique_events if unique_events else 0.0,
+        "answer_latency": {
+            "mean": sum(latencies) / len(latencies) if latencies else 0.0,
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+            "max": max(latencies, default=0.0),
+        },
+        "delivery_seconds": dispatched_at - started,
+        "total_seconds": finished_at - started,
+        "answers_per_second": len(latencies) / (finished_at - started) if finished_at > started else 0.0,
+        "slack_api_calls": len(client.messages),
+    }
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as work_dir:
+        benchmark.configure_offline(work_dir, args)
+        main.generation_manager.max_concurrent = args.llm_concurrency
+        with benchmark.quiet(not args.verbose):
+            prepare_companies(work_dir, COMPANIES, args.pages, args.seed)
+
+        if args.events:
+            events = load_events(args.events)
+            channels = sorted({body["event"]["channel"] for body in events})
+        else:
+            channels = [f"CREPLAY{i:03d}" for i in range(args.channels)]
+            events = synthetic_events(args.count, channels, rng, args.redelivery_rate)
+        mappings = slack_bot.load_channel_mappings(args.mappings) if args.mappings else {}
+        for i, channel in enumerate(channels):
+            mappings.setdefault(channel, COMPANIES[i % len(COMPANIES)])
+
+        client = FakeSlackClient(latency_seconds=args.slack_latency)
+        bot = ReplayBot(client, mappings, mapping_file=None, worker_count=args.workers,
+                        max_pending=args.max_pending, stream_update_interval=args.stream_update_interval)
+        print(f"Replaying {len(events)} events over {len(channels)} channels "
+              f"({args.rate or 'recorded'} events/s, {args.workers} workers, {args.llm_concurrency} generation slots)")
+        with benchmark.quiet(not args.verbose):
+            started, dispatched_at = replay(bot, events, schedule(events, args.rate))
+        results = summarize(bot, client, events, started, dispatched_at)
+
+    results["settings"] = vars(args)
+    results["commit"] = benchmark.git_commit()
+    return results
+
+
+def cli():
+    parser = argparse.ArgumentParser(description="Replay app_mention events through the Slack bot against a fake "
+                                                 "Slack, in-memory Qdrant and a fake LLM")
+    parser.add_argument("--events", help="Recorded events, one JSON body per line (default: synthetic questions)")
+    parser.add_argument("--mappings", help="Channel to company mappings for recorded events (channel_mappings.json)")
+    parser.add_argument("--count", type=int, default=200, help="Synthetic questions to send")
+    parser.add_argument("--channels", type=int, default=20, help="Channels the synthetic questions come from")
+    parser.add_argument("--rate", type=float, default=10.0,
+                        help="Events delivered per second (0 replays recorded events at their original spacing)")
+    parser.add_argument("--redelivery-rate", type=float, default=0.05,
+                        help="Share of events Slack delivers a second time")
+    parser.add_argument("--workers", type=int, default=slack_bot.WORKER_COUNT)
+    parser.add_argument("--max-pending", type=int, default=slack_bot.MAX_PENDING_QUESTIONS)
+    parser.add_argument("--stream-update-interval", type=float, default=slack_bot.STREAM_UPDATE_INTERVAL)
+    parser.add_argument("--llm-concurrency", type=int, default=main.llm_max_concurrent_generations)
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="Seconds before the fake LLM starts answering")
+    parser.add_argument("--llm-token-latency", type=float, default=0.02, help="Seconds per generated token")
+    parser.add_argument("--slack-latency", type=float, default=0.05, help="Seconds per fake Slack API call")
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="Seconds of fake latency per embedding batch")
+    parser.add_argument("--embed-batch-size", type=int, default=64)
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--query-batch-window", type=float, default=main.query_batch_window_seconds)
+    parser.add_argument("--pages", type=int, default=20, help="Pages of the generated PDF each company is given")
+    parser.add_argument("--qdrant-path", help="Use a local on-disk Qdrant at this path instead of :memory:")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="slack_replay_results.json", help="Where to write the JSON results")
+    parser.add_argument("--max-p95", type=float, help="Exit non-zero if the p95 answer latency exceeds this (seconds)")
+    parser.add_argument("--max-error-rate", type=float, help="Exit non-zero if the error rate exceeds this share")
+    parser.add_argument("--verbose", action="store_true", help="Show the bot's own output")
+    args = parser.parse_args()
+
+    results = run(args)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    latency = results["answer_latency"]
+    print(f"Handled {results['completed']} of {results['unique_events']} questions "
+          f"({results['redeliveries']} redelivered events) in {results['total_seconds']:.1f}s, "
+          f"{results['answers_per_second']:.2f} answers/s")
+    print(f"Answer latency p50/p95/p99/max {latency['p50']:.2f}/{latency['p95']:.2f}/{latency['p99']:.2f}/"
+          f"{latency['max']:.2f}s")
+    print(f"Replies: {results['replies']}")
+    print(f"Duplicate replies {results['duplicate_replies']}, error rate {results['error_rate']:.1%}, "
+          f"rejection rate {results['rejection_rate']:.1%}")
+    print(f"Results written to {args.output}")
+
+    failures = []
+    if args.max_p95 is not None and latency["p95"] > args.max_p95:
+        failures.append(f"p95 answer latency {latency['p95']:.2f}s is over {args.max_p95}s")
+    if args.max_error_rate is not None and results["error_rate"] > args.max_error_rate:
+        failures.append(f"error rate {results['error_rate']:.1%} is over {args.max_error_rate:.1%}")
+    if results["duplicate_replies"]:
+        failures.append(f"{results['duplicate_replies']} questions were answered more than once")
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    cli()
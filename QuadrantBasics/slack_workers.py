@@ -0,0 +1,122 @@
+import threading
+import time
+from collections import OrderedDict, deque
+
+from metrics import metrics
+
+
+class EventDeduplicator:
+    """Remembers recently seen Slack event IDs so re-delivered events are answered once"""
+
+    def __init__(self, ttl_seconds=600, max_entries=10000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+
+    def seen(self, *keys):
+        """Record the keys and return True if any of them was already recorded"""
+        keys = [key for key in keys if key]
+        now = time.time()
+        with self._lock:
+            # Drop entries that are older than Slack's retry window
+            while self._seen and now - next(iter(self._seen.values())) > self.ttl_seconds:
+                self._seen.popitem(last=False)
+
+            duplicate = any(key in self._seen for key in keys)
+            for key in keys:
+                self._seen[key] = now
+                self._seen.move_to_end(key)
+            while len(self._seen) > self.max_entries:
+                self._seen.popitem(last=False)
+        return duplicate
+
+
+class ChannelWorkerPool:
+    """Bounded worker pool that runs jobs in FIFO order per channel and round-robin across channels"""
+
+    def __init__(self, max_workers=4, max_pending=100):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+
+        self._queues = {}
+        self._ready = deque()
+        self._active = set()
+        self._running = 0
+        self._pending = 0
+        self._condition = threading.Condition()
+        self._threads = [
+            threading.Thread(target=self._work, name=f"slack-worker-{i}", daemon=True)
+            for i in range(max_workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, channel_id, job):
+        """Queue a job for a channel.
+
+        Returns (position, busy): position is the job's place in line, meaning the channels served
+        before its channel's next turn plus its place in its channel queue (counting any job already
+        running there), and busy is True when no worker was free. Returns (None, True) when the pool
+        is full and the job was rejected.
+        """
+        with self._condition:
+            if self._pending >= self.max_pending:
+                metrics.increment("slack_jobs_rejected_total")
+                return None, True
+
+            queue = self._queues.setdefault(channel_id, deque())
+            queue.append((job, time.perf_counter()))
+            self._pending += 1
+            busy = self._running + self._pending > self.max_workers
+
+            # A channel goes on the ready list only once, so its jobs never run in parallel
+            if channel_id not in self._active and len(queue) == 1:
+                self._ready.append(channel_id)
+                self._condition.notify()
+
+            # Every channel ahead on the ready list gets a turn first; a channel with a job running rejoins
+            # at the back of the list when it finishes
+            ahead = self._ready.index(channel_id) if channel_id in self._ready else len(self._ready)
+            position = ahead + len(queue) + (1 if channel_id in self._active else 0)
+            metrics.set_gauge("slack_queue_depth", self._pending)
+        return position, busy
+
+    def depth(self):
+        """Return the number of queued (not yet running) jobs"""
+        with self._condition:
+            return self._pending
+
+    def idle(self):
+        """Return True when no job is queued or running"""
+        with self._condition:
+            return self._pending == 0 and self._running == 0
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._ready:
+                    self._condition.wait()
+                channel_id = self._ready.popleft()
+                job, queued_at = self._queues[channel_id].popleft()
+                self._active.add(channel_id)
+                self._pending -= 1
+                self._running += 1
+                metrics.set_gauge("slack_queue_depth", self._pending)
+
+            metrics.observe("slack_queue_wait_seconds", time.perf_counter() - queued_at)
+            try:
+                job()
+            except Exception as e:
+                print(f"Error in Slack worker for channel {channel_id}: {str(e)}")
+            finally:
+                with self._condition:
+                    self._running -= 1
+                    self._active.discard(channel_id)
+
+                    # Put the channel at the back of the line so busy channels can't starve quiet ones
+                    if self._queues[channel_id]:
+                        self._ready.append(channel_id)
+                        self._condition.notify()
+                    else:
+                        del self._queues[channel_id]
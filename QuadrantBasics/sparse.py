@@ -0,0 +1,61 @@
+import re
+import zlib
+from collections import Counter
+
+# Name of the sparse vector stored next to the default dense vector
+SPARSE_VECTOR_NAME = "text-sparse"
+
+# BM25 term frequency saturation and length normalisation; IDF is applied by Qdrant at query time
+k1 = 1.2
+b = 0.75
+average_document_length = 300
+
+# Keeps identifiers like "INV-2024/0042" or "A1.23b" together as single tokens
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+
+
+def tokenize(text):
+    """Lowercase word tokens; compound identifiers also yield their parts so partial matches still score"""
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        tokens.append(token)
+        parts = re.split(r"[-_./]", token)
+        if len(parts) > 1:
+            tokens.extend(part for part in parts if part)
+    return tokens
+
+
+def token_index(token):
+    # crc32 is stable across processes, unlike hash()
+    return zlib.crc32(token.encode("utf-8"))
+
+
+def _to_sparse(weights):
+    from qdrant_client import models
+
+    indices = sorted(weights)
+    return models.SparseVector(indices=indices, values=[weights[i] for i in indices])
+
+
+def document_vector(text):
+    """BM25 weighted term frequencies for a chunk"""
+    counts = Counter(token_index(token) for token in tokenize(text))
+    length = sum(counts.values())
+    norm = k1 * (1 - b + b * length / average_document_length)
+    return _to_sparse({index: tf * (k1 + 1) / (tf + norm) for index, tf in counts.items()})
+
+
+def query_vector(text):
+    """Each distinct query term counts once; Qdrant's IDF modifier weights rare terms up"""
+    return _to_sparse({token_index(token): 1.0 for token in set(tokenize(text))})
+
+
+def sparse_vectors_config():
+    from qdrant_client import models
+
+    return {
+        SPARSE_VECTOR_NAME: models.SparseVectorParams(
+            index=models.SparseIndexParams(on_disk=False),
+            modifier=models.Modifier.IDF,
+        )
+    }
@@ -1,5 +1,38 @@
+import threading
+import time
+
+# Streamlit runs this script again on every interaction; the time each run takes is shown in the sidebar
+run_started = time.perf_counter()
+
 import streamlit as st
 import main as main
+import tracing
+from metrics import metrics
+
+# Prometheus endpoint and OpenTelemetry spans, when METRICS_PORT / OTEL_TRACING are set
+tracing.start_exporters()
+
+
+@st.cache_resource(show_spinner="Connecting to the company database...")
+def get_database(company):
+    # One vector store per company for the whole server rather than a lookup on every rerun
+    return main.create_qdrant_database(company)
+
+
+@st.cache_data(ttl=main.stats_ttl_seconds, show_spinner=False)
+def get_collection_stats(company):
+    return main.collection_stats(company)
+
+
+@st.cache_resource(show_spinner=False)
+def start_preload():
+    # Once per server: load the model and clients in the background so the first question isn't a cold start
+    thread = threading.Thread(target=main.preload, name="preload", daemon=True)
+    thread.start()
+    return thread
+
+
+start_preload()
 
 st.title("Chat with Company PDFs")
 
@@ -12,12 +45,13 @@ companies = ["Company A", "Company B", "Company C"]  # You can modify this list
 selected_company = st.selectbox("Select Company", companies)
 
 # Initialize vector database for the selected company
-db = main.create_qdrant_database(selected_company)
+db = get_database(selected_company)
 
 # Display debug information
 st.sidebar.write("Debug Information:")
-doc_list = main.retrieve_doc_by_metadata(company=selected_company, file_name="")
-st.sidebar.write(f"Number of documents in collection: {len(doc_list[0]) if doc_list else 0}")
+stats = get_collection_stats(selected_company)
+st.sidebar.write(f"Number of documents in collection: {stats['files']}")
+st.sidebar.write(f"Number of chunks in collection: {stats['chunks']}")
 
 # Display chat history
 for message in st.session_state.messages:
@@ -31,13 +65,16 @@ if question := st.chat_input("Ask a question about your company's documents"):
     st.session_state.messages.append({"role": "user", "content": question})
     
     try:
-        # Get response with company filter
-        related_documents = main.retrieve_docs(db, question, selected_company)
+        # Get response with company filter, reusing a cached answer to a similar question if there is one
+        tokens, related_documents, from_cache = main.answer_question_stream(db, question, selected_company)
         st.sidebar.write(f"Found {len(related_documents)} related documents")
+        if from_cache:
+            st.sidebar.write("Answer served from cache")
         
         if not related_documents:
             st.warning("No relevant documents found for your query.")
             answer = "I couldn't find any relevant information in the documents to answer your question."
+            st.chat_message("assistant").write(answer)
         else:
             # Show relevance scores in debug info
             st.sidebar.write("Document Relevance Scores:")
@@ -45,14 +82,17 @@ if question := st.chat_input("Ask a question about your company's documents"):
                 filename = doc.metadata.get('file_name', 'Unknown')
                 st.sidebar.write(f"{filename}: {score:.4f}")
             
-            answer = main.question_pdf(question, related_documents)
+            # Display assistant response as it is generated
+            answer = st.chat_message("assistant").write_stream(tokens)
         
-        # Display assistant response
-        st.chat_message("assistant").write(answer)
         st.session_state.messages.append({"role": "assistant", "content": answer})
     except Exception as e:
         st.error(f"Error processing query: {str(e)}")
 
+run_seconds = time.perf_counter() - run_started
+metrics.observe("streamlit_run_seconds", run_seconds, page="chat")
+st.sidebar.caption(f"Page ran in {run_seconds * 1000:.0f} ms")
+
 # Add a clear chat button
 if st.button("Clear Chat History"):
     st.session_state.messages = []
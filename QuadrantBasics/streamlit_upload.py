@@ -1,8 +1,83 @@
+import time
+
+# Streamlit runs this script again on every interaction; the time each run takes is shown in the sidebar
+run_started = time.perf_counter()
+
 import streamlit as st
 import main as main
-import os
+import tracing
+from metrics import metrics
+from upload_jobs import UploadJobQueue
 from uuid import uuid4
 
+# Prometheus endpoint and OpenTelemetry spans, when METRICS_PORT / OTEL_TRACING are set
+tracing.start_exporters()
+
+
+@st.cache_resource(show_spinner="Connecting to the company database...")
+def get_database(company):
+    # One vector store per company for the whole server rather than a lookup on every rerun
+    return main.create_qdrant_database(company)
+
+
+@st.cache_data(ttl=main.stats_ttl_seconds, show_spinner=False)
+def get_collection_stats(company):
+    return main.collection_stats(company)
+
+
+def ingest_upload(company, file_name, data, progress_callback):
+    # Parsed straight from the uploaded bytes; nothing is written to pdfs/ and read back
+    return main.add_pdf_bytes_to_vector_db(main.create_qdrant_database(company), data, file_name, company,
+                                           progress_callback=progress_callback)
+
+
+@st.cache_resource
+def get_upload_jobs():
+    # Shared by every session and rerun, so jobs keep running and stay listed while the page reloads
+    return UploadJobQueue(ingest_upload, page_count=main.pdf_page_count, max_workers=2)
+
+
+def describe_job(job):
+    if job.status == "queued":
+        return f"queued for {job.wait_seconds:.0f}s"
+    if job.status == "running":
+        chunks = job.progress.get("total_chunks", 0)
+        page = job.progress.get("last_page")
+        where = f"page {page + 1} of {job.pages}" if page is not None and job.pages else "parsing"
+        return f"{where}, {chunks} chunks, {job.run_seconds:.0f}s"
+    timings = f"waited {job.wait_seconds:.1f}s, ran {job.run_seconds:.1f}s"
+    if job.status == "done" and "kept" in job.progress:
+        return (f"✅ updated: kept {job.progress['kept']}, reused {job.progress['reused']}, "
+                f"deleted {job.progress['deleted']}, added {job.progress['added']} chunks ({timings})")
+    if job.status == "done":
+        return f"✅ added {job.progress.get('total_chunks', 0)} chunks ({timings})"
+    if job.status == "duplicate":
+        return f"⚠️ already in the collection ({timings})"
+    return f"❌ failed: {job.error} ({timings})"
+
+
+def show_jobs(company):
+    upload_jobs = get_upload_jobs()
+    jobs = upload_jobs.jobs(company)
+    if not jobs:
+        return
+    st.subheader("Uploads")
+    for job in jobs:
+        st.progress(job.fraction, text=f"{job.file_name}: {describe_job(job)}")
+
+    active = upload_jobs.active(company)
+    if not active and st.session_state.get("upload_jobs_active"):
+        # The last job just finished: refresh the whole page so the collection stats include it
+        st.session_state.upload_jobs_active = False
+        get_collection_stats.clear()
+        st.rerun()
+    st.session_state.upload_jobs_active = active
+
+    if not active and st.button("Clear finished uploads"):
+        upload_jobs.clear_finished(company)
+        st.rerun()
+
+
 st.title("Upload PDFs to Company Database")
 
 # Initialize session state for tracking the selected company
@@ -25,42 +100,33 @@ else:
 st.session_state.previous_company = selected_company
 
 # Initialize vector database for the selected company
-db = main.create_qdrant_database(selected_company)
+db = get_database(selected_company)
 
 # Display debug information
 st.sidebar.write("Debug Information:")
-doc_list = main.retrieve_doc_by_metadata(company=selected_company, file_name="")
-st.sidebar.write(f"Number of documents in collection: {len(doc_list[0]) if doc_list else 0}")
+stats = get_collection_stats(selected_company)
+st.sidebar.write(f"Number of documents in collection: {stats['files']}")
+st.sidebar.write(f"Number of chunks in collection: {stats['chunks']}")
 
-uploaded_file = st.file_uploader(
-    "Upload PDF",
+uploaded_files = st.file_uploader(
+    "Upload PDFs",
     type="pdf",
-    accept_multiple_files=False,
+    accept_multiple_files=True,
     key=st.session_state.file_uploader_key  # Use dynamic key to force reset
 )
 
-if uploaded_file:
-    file_name = uploaded_file.name
-    
-    # Check if file exists in the selected company's collection
-    doc_list = main.retrieve_doc_by_metadata(company=selected_company, file_name=file_name)
-    file_exists = len(doc_list[0]) > 0
-    
-    if file_exists:
-        st.error(f"This PDF already exists in {selected_company}'s collection.")
-    else:
-        try:
-            # Save the PDF file
-            main.upload_pdf(uploaded_file)
-            
-            # Add the document to the company's collection
-            result = main.add_documents_to_vector_db(db, main.pdfs_directory + file_name, selected_company)
-            if result == "Docs added to db":
-                st.success(f"PDF successfully uploaded to {selected_company}'s collection")
-                # Update document count
-                doc_list = main.retrieve_doc_by_metadata(company=selected_company, file_name="")
-                st.sidebar.write(f"Updated number of documents: {len(doc_list[0]) if doc_list else 0}")
-            else:
-                st.warning(result)
-        except Exception as e:
-            st.error(f"Error uploading file: {str(e)}")
\ No newline at end of file
+if uploaded_files and st.button(f"Add {len(uploaded_files)} PDF(s) to {selected_company}'s collection"):
+    for uploaded_file in uploaded_files:
+        get_upload_jobs().submit(selected_company, uploaded_file.name, uploaded_file.getvalue())
+    st.session_state.upload_jobs_active = True
+
+    # Clear the uploader so the same files aren't queued again on the next rerun
+    st.session_state.file_uploader_key = str(uuid4())
+    st.rerun()
+
+# Only this part of the page refreshes while jobs run (once a second), so the rest stays usable
+st.fragment(run_every=1 if get_upload_jobs().active(selected_company) else None)(show_jobs)(selected_company)
+
+run_seconds = time.perf_counter() - run_started
+metrics.observe("streamlit_run_seconds", run_seconds, page="upload")
+st.sidebar.caption(f"Page ran in {run_seconds * 1000:.0f} ms")
@@ -0,0 +1,117 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from generation import BULK, INTERACTIVE, GenerationManager
+
+
+def test_second_waiter_takes_free_slot_without_waiting_for_first():
+    manager = GenerationManager(get_model=lambda: None, build_chain=lambda model: None, max_concurrent=2)
+    holding = [manager.slot(), manager.slot()]
+    for slot in holding:
+        slot.__enter__()
+
+    acquired = set()
+    release_first = threading.Event()
+
+    def wait_for_slot(name, priority, hold_until=None):
+        with manager.slot(priority):
+            acquired.add(name)
+            if hold_until is not None:
+                hold_until.wait(10)
+
+    # The bulk request starts waiting first, so it is woken first but finds the interactive one ahead of it
+    second = threading.Thread(target=wait_for_slot, args=("second", BULK))
+    first = threading.Thread(target=wait_for_slot, args=("first", INTERACTIVE, release_first))
+    for expected, thread in enumerate([second, first], start=1):
+        thread.start()
+        while manager.queue_depth < expected:
+            time.sleep(0.001)
+
+    # Both slots free up together; the first waiter then holds its slot for a long generation
+    with manager._slots:
+        for slot in holding:
+            slot.__exit__(None, None, None)
+    second.join(2)
+    got_slot_while_first_ran = "second" in acquired
+    release_first.set()
+    first.join(2)
+    second.join(2)
+
+    assert got_slot_while_first_ran
+
+
+def test_waiters_run_in_priority_order():
+    manager = GenerationManager(get_model=lambda: None, build_chain=lambda model: None, max_concurrent=1)
+    holding = manager.slot()
+    holding.__enter__()
+
+    order = []
+
+    def wait_for_slot(name, priority):
+        with manager.slot(priority):
+            order.append(name)
+
+    threads = [threading.Thread(target=wait_for_slot, args=("bulk", BULK)),
+               threading.Thread(target=wait_for_slot, args=("interactive", INTERACTIVE))]
+    for expected, thread in enumerate(threads, start=1):
+        thread.start()
+        while manager.queue_depth < expected:
+            time.sleep(0.001)
+
+    holding.__exit__(None, None, None)
+    for thread in threads:
+        thread.join(2)
+
+    assert order == ["interactive", "bulk"]
+
+
+class EchoChain:
+    async def ainvoke(self, chain_input):
+        await asyncio.sleep(0.01)
+        return chain_input
+
+
+def test_async_waiters_leave_executor_threads_free():
+    manager = GenerationManager(get_model=lambda: None, build_chain=lambda model: EchoChain(), max_concurrent=1)
+    holding = manager.slot()
+    holding.__enter__()
+
+    async def scenario():
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=1))
+        answers = [asyncio.ensure_future(manager.ainvoke(name, priority))
+                   for name, priority in [("bulk", BULK), ("interactive", INTERACTIVE)]]
+        while manager.queue_depth < 2:
+            await asyncio.sleep(0.001)
+
+        # Blocking work sent to the executor still runs while both questions wait for the slot
+        started = time.perf_counter()
+        await asyncio.to_thread(time.sleep, 0)
+        executor_wait = time.perf_counter() - started
+
+        threading.Timer(0.05, holding.__exit__, (None, None, None)).start()
+        finished = []
+        for answer in asyncio.as_completed(answers):
+            finished.append(await answer)
+        return executor_wait, finished
+
+    executor_wait, finished = asyncio.run(scenario())
+    assert executor_wait < 0.5
+    assert finished == ["interactive", "bulk"]
+
+
+def test_async_waiter_times_out():
+    manager = GenerationManager(get_model=lambda: None, build_chain=lambda model: EchoChain(), max_concurrent=1)
+    holding = manager.slot()
+    holding.__enter__()
+
+    async def scenario():
+        try:
+            await manager.ainvoke("question", timeout=0.05)
+        except TimeoutError:
+            return manager.queue_depth
+        return None
+
+    assert asyncio.run(scenario()) == 0
+    holding.__exit__(None, None, None)
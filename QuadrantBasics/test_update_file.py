@@ -0,0 +1,72 @@
+import argparse
+from uuid import uuid4
+
+import benchmark
+import main
+from fakes import make_pdf
+
+
+def configure(tmp_path):
+    args = argparse.Namespace(qdrant_path=None, dimension=64, embed_batch_size=64, embed_latency=0.0,
+                              query_batch_window=0.0, llm_latency=0.0, llm_token_latency=0.0, verbose=False)
+    benchmark.configure_offline(str(tmp_path), args)
+
+
+def edit_last_page(source, destination):
+    # Swap one letter on the last page; the length is unchanged, so the PDF's byte offsets stay valid
+    data = bytearray(source.read_bytes())
+    position = data.rindex(b") Tj") - 1
+    data[position] = ord("x") if data[position] != ord("x") else ord("y")
+    destination.write_bytes(bytes(data))
+
+
+def test_rolling_back_to_an_earlier_version_is_not_refused(tmp_path):
+    configure(tmp_path)
+    company = "Company Rollback"
+    db = main.create_qdrant_database(company)
+    v1 = tmp_path / "v1" / "manual.pdf"
+    v2 = tmp_path / "v2" / "manual.pdf"
+    v1.parent.mkdir()
+    v2.parent.mkdir()
+    make_pdf(str(v1), 3)
+    edit_last_page(v1, v2)
+    v1_hash, v2_hash = main.hash_file(str(v1)), main.hash_file(str(v2))
+
+    assert main.add_documents_to_vector_db(db, str(v1), company) == "Docs added to db"
+    assert main.add_documents_to_vector_db(db, str(v2), company) == "Doc Updated"
+    assert main.document_exists(company, v2_hash)
+    assert not main.document_exists(company, v1_hash)
+
+    assert main.add_documents_to_vector_db(db, str(v1), company) == "Doc Updated"
+    assert main.document_exists(company, v1_hash)
+    assert not main.document_exists(company, v2_hash)
+
+    # Even without the manifest, Qdrant's markers say only the current version is stored
+    main.file_manifest.clear(company)
+    assert main.document_exists(company, v1_hash)
+    assert not main.document_exists(company, v2_hash)
+    assert main.add_documents_to_vector_db(db, str(v1), company) == "Doc Already Exists"
+
+
+def test_updating_a_file_stored_before_pages_were_recorded(tmp_path):
+    from qdrant_client import models
+
+    configure(tmp_path)
+    company = "Company Legacy"
+    db = main.create_qdrant_database(company)
+    pdf = tmp_path / "manual.pdf"
+    make_pdf(str(pdf), 3)
+
+    # The original ingest stored only the file name and company, under random IDs
+    texts = ["an old chunk about the warranty", "an old chunk about the battery"]
+    main.qdrant_client.upsert(collection_name=main.collection_for_company(company), points=[
+        models.PointStruct(id=str(uuid4()), vector=vector,
+                           payload={"text": text, "metadata": {"file_name": "manual.pdf", "company": company}})
+        for text, vector in zip(texts, main.get_embeddings().embed_documents(texts))
+    ])
+
+    assert main.add_documents_to_vector_db(db, str(pdf), company) == "Doc Updated"
+    stored = main.stored_pages(company, "manual.pdf")
+    assert None not in stored and stored
+    assert main.document_exists(company, main.hash_file(str(pdf)))
+    assert main.add_documents_to_vector_db(db, str(pdf), company) == "Doc Already Exists"
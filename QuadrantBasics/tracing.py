@@ -0,0 +1,243 @@
+import contextvars
+import json
+import os
+import threading
+import time
+
+from metrics import metrics
+
+# Port for the Prometheus /metrics endpoint; 0 leaves the exporter off
+prometheus_port = int(os.environ.get("METRICS_PORT", "0"))
+
+# Set OTEL_TRACING=1 to also emit OpenTelemetry spans (the provider and exporter are configured as usual for OTel)
+otel_enabled = os.environ.get("OTEL_TRACING", "") == "1"
+
+# Requests slower than this have their stage breakdown written to the slow request log
+slow_request_seconds = float(os.environ.get("SLOW_REQUEST_SECONDS", "10"))
+slow_request_log = os.environ.get("SLOW_REQUEST_LOG", "slow_requests.log")
+
+# Stage durations span from a few milliseconds (cache hits) to minutes (large PDFs on CPU)
+stage_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+_current_request = contextvars.ContextVar("current_request", default=None)
+_exporters_lock = threading.Lock()
+_exporters_started = False
+_stage_seconds = None
+_stage_errors = None
+_tracer = None
+
+# Functions returning a stats() dict (cache hit rates and sizes) exported as gauges named <source>_<key>
+stats_sources = {}
+
+
+def register_stats(source, stats):
+    """Export stats()-style dicts to Prometheus, e.g. register_stats("answer_cache", answer_cache.stats)"""
+    stats_sources[source] = stats
+
+
+class PrometheusMirror:
+    """Creates a Prometheus counter, gauge or histogram the first time each in-process metric is recorded"""
+
+    # Already exported with their own names by record_stage
+    skip = {"stage_seconds"}
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _metric(self, kind, name, labels, **options):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = kind(name, name.replace("_", " "), sorted(labels), **options)
+            metric = self._metrics[name]
+        return metric.labels(**{k: str(v) for k, v in labels.items()}) if labels else metric
+
+    def increment(self, name, amount=1, **labels):
+        from prometheus_client import Counter
+        self._metric(Counter, name, labels).inc(amount)
+
+    def set_gauge(self, name, value, **labels):
+        from prometheus_client import Gauge
+        self._metric(Gauge, name, labels).set(value)
+
+    def observe(self, name, value, **labels):
+        if name in self.skip:
+            return
+        from prometheus_client import Histogram
+        # Latencies share the stage buckets; sizes and token counts use the client's defaults
+        options = {"buckets": stage_buckets} if name.endswith("_seconds") else {}
+        self._metric(Histogram, name, labels, **options).observe(value)
+
+
+class StatsCollector:
+    """Reads every registered stats() dict at scrape time; nested dicts (entries per company) become labels"""
+
+    def collect(self):
+        from prometheus_client.core import GaugeMetricFamily
+        for source, stats in list(stats_sources.items()):
+            for key, value in (stats() or {}).items():
+                name = f"{source}_{key}"
+                if isinstance(value, dict):
+                    family = GaugeMetricFamily(name, f"{source} {key}", labels=["company"])
+                    for company, count in value.items():
+                        family.add_metric([str(company)], count)
+                    yield family
+                elif isinstance(value, (int, float)):
+                    yield GaugeMetricFamily(name, f"{source} {key}", value=value)
+
+
+def start_exporters():
+    """Start the Prometheus endpoint and OpenTelemetry tracer if they are enabled; safe to call repeatedly"""
+    global _exporters_started, _stage_seconds, _stage_errors, _tracer
+    with _exporters_lock:
+        if _exporters_started:
+            return
+        _exporters_started = True
+
+        if prometheus_port:
+            try:
+                from prometheus_client import REGISTRY, Counter, Histogram, start_http_server
+            except ImportError as e:
+                raise ImportError("METRICS_PORT needs `pip install prometheus-client`") from e
+            _stage_seconds = Histogram("rag_stage_seconds", "Time spent in each pipeline stage",
+                                       ["company", "stage"], buckets=stage_buckets)
+            _stage_errors = Counter("rag_stage_errors_total", "Pipeline stages that raised",
+                                    ["company", "stage"])
+            # Queue depths, time to answer and cache stats are exported under their in-process names
+            metrics.add_mirror(PrometheusMirror())
+            REGISTRY.register(StatsCollector())
+            start_http_server(prometheus_port)
+            print(f"Prometheus metrics on port {prometheus_port}")
+
+        if otel_enabled:
+            try:
+                from opentelemetry import trace
+            except ImportError as e:
+                raise ImportError("OTEL_TRACING needs `pip install opentelemetry-api opentelemetry-sdk`") from e
+            _tracer = trace.get_tracer("quadrant-basics")
+
+
+def record_stage(stage, seconds, company=None, error=False):
+    """Record a stage duration measured elsewhere, e.g. across a stream of tokens"""
+    request = _current_request.get()
+    company = company or (request["company"] if request else None) or "unknown"
+    metrics.observe("stage_seconds", seconds, stage=stage, company=company)
+    if request is not None:
+        # The same stage can run many times per request (one embed per batch), so durations add up
+        stages = request["stages"]
+        stages[stage] = stages.get(stage, 0.0) + seconds
+    if _stage_seconds is not None:
+        _stage_seconds.labels(company, stage).observe(seconds)
+        if error:
+            _stage_errors.labels(company, stage).inc()
+
+
+class span:
+    """Time a block as one pipeline stage: `with span("embed_query", company): ...`"""
+
+    __slots__ = ("stage", "company", "started", "_otel")
+
+    def __init__(self, stage, company=None):
+        self.stage = stage
+        self.company = company
+        self._otel = None
+
+    def __enter__(self):
+        if _tracer is not None:
+            self._otel = _tracer.start_as_current_span(self.stage, attributes={"company": self.company or ""})
+            self._otel.__enter__()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        record_stage(self.stage, time.perf_counter() - self.started, self.company, error=exc_type is not None)
+        if self._otel is not None:
+            self._otel.__exit__(exc_type, exc, tb)
+        return False
+
+
+class trace_request:
+    """Collect the stage breakdown of one request and log it if the request is slow.
+
+    Nested calls (answer_question inside a Slack answer) join the outer request.
+    """
+
+    def __init__(self, name, company=None, **details):
+        self.name = name
+        self.company = company
+        self.details = details
+        self._token = None
+        self._span = span(name, company)
+
+    def __enter__(self):
+        if _current_request.get() is None:
+            self.request = {"request": self.name, "company": self.company, "stages": {}, **self.details}
+            self._token = _current_request.set(self.request)
+        else:
+            self.request = _current_request.get()
+        self.started = time.perf_counter()
+        self._span.__enter__()
+        return self.request
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._token is None:
+            self._span.__exit__(exc_type, exc, tb)
+            return False
+
+        # Leave the request first so the overall time isn't listed as one of its own stages
+        try:
+            _current_request.reset(self._token)
+        except ValueError:
+            pass  # ended from another context, e.g. a streamed answer closed by the garbage collector
+        self._span.__exit__(exc_type, exc, tb)
+        total = time.perf_counter() - self.started
+        if total >= slow_request_seconds:
+            log_slow_request(self.request, total, failed=exc_type is not None)
+        return False
+
+
+def end_request_after(request, iterator):
+    """Yield from iterator, ending request (an entered trace_request) once it is exhausted, fails or is closed"""
+    try:
+        yield from iterator
+    except GeneratorExit:
+        # The reader stopped early, e.g. a Streamlit rerun; the request still ends here
+        request.__exit__(None, None, None)
+        raise
+    except BaseException as e:
+        request.__exit__(type(e), e, e.__traceback__)
+        raise
+    request.__exit__(None, None, None)
+
+
+def in_request(fn):
+    """Wrap fn so it joins the current request when run on another thread (e.g. a pool worker)"""
+    request = _current_request.get()
+
+    def run(*args, **kwargs):
+        token = _current_request.set(request)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current_request.reset(token)
+
+    return run
+
+
+def log_slow_request(request, total, failed=False):
+    entry = {
+        "at": time.time(),
+        "total_seconds": round(total, 4),
+        "failed": failed,
+        **request,
+        "stages": {stage: round(seconds, 4) for stage, seconds in
+                   sorted(request["stages"].items(), key=lambda item: item[1], reverse=True)},
+    }
+    metrics.increment("slow_requests_total", request=request["request"])
+    print(f"Slow {request['request']} for {request['company']} ({total:.2f}s): "
+          + ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in entry["stages"].items()))
+    try:
+        with open(slow_request_log, "a") as f:
+            f.write(json.dumps(entry, default=str) + "\n")
+    except OSError as e:
+        print(f"Error writing slow request log: {str(e)}")
@@ -0,0 +1,121 @@
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import metrics
+
+# Statuses a job moves through; the last three are final
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+DUPLICATE = "duplicate"
+FAILED = "failed"
+
+
+class UploadJob:
+    """One uploaded PDF waiting for, or going through, ingestion"""
+
+    def __init__(self, job_id, company, file_name, data):
+        self.id = job_id
+        self.company = company
+        self.file_name = file_name
+        self.size_bytes = len(data)
+        self.data = data
+        self.status = QUEUED
+        self.pages = None
+        self.progress = {}
+        self.error = None
+        self.queued_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def finished(self):
+        return self.status in (DONE, DUPLICATE, FAILED)
+
+    @property
+    def fraction(self):
+        """Share of the PDF ingested so far, from the last page of the most recent batch"""
+        if self.finished:
+            return 1.0
+        if not self.pages or "last_page" not in self.progress:
+            return 0.0
+        return min(1.0, (self.progress["last_page"] + 1) / self.pages)
+
+    @property
+    def wait_seconds(self):
+        return (self.started_at or time.time()) - self.queued_at
+
+    @property
+    def run_seconds(self):
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+
+class UploadJobQueue:
+    """Ingests uploaded PDFs on background threads so the page that queued them stays responsive.
+
+    Keep one per process (st.cache_resource) so jobs outlive reruns and browser refreshes.
+    """
+
+    def __init__(self, ingest, page_count=None, max_workers=2, max_finished=100):
+        # ingest(company, file_name, data, progress_callback) returns a main.py style result string
+        self.ingest = ingest
+        self.page_count = page_count
+        self.max_finished = max_finished
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="upload-job")
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._jobs = {}
+
+    def submit(self, company, file_name, data):
+        with self._lock:
+            job = UploadJob(next(self._ids), company, file_name, data)
+            self._jobs[job.id] = job
+            self._trim()
+        metrics.increment("upload_jobs_total")
+        self._pool.submit(self._run, job)
+        return job
+
+    def jobs(self, company=None):
+        """Jobs newest first, optionally for one company"""
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return [job for job in reversed(jobs) if company is None or job.company == company]
+
+    def active(self, company=None):
+        return any(not job.finished for job in self.jobs(company))
+
+    def clear_finished(self, company=None):
+        with self._lock:
+            for job_id in [job.id for job in self._jobs.values()
+                           if job.finished and (company is None or job.company == company)]:
+                del self._jobs[job_id]
+
+    def _trim(self):
+        # Forget the oldest finished jobs so a long running server doesn't keep every result
+        finished = [job.id for job in self._jobs.values() if job.finished]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job_id]
+
+    def _run(self, job):
+        job.started_at = time.time()
+        job.status = RUNNING
+        metrics.observe("upload_job_wait_seconds", job.wait_seconds)
+        try:
+            if self.page_count:
+                job.pages = self.page_count(job.data)
+            result = self.ingest(job.company, job.file_name, job.data, job.progress.update)
+            job.status = DUPLICATE if result == "Doc Already Exists" else DONE
+        except Exception as e:
+            print(f"Error ingesting {job.file_name} for {job.company}: {str(e)}")
+            job.error = str(e)
+            job.status = FAILED
+        finally:
+            job.finished_at = time.time()
+            # The PDF is in Qdrant (or failed); don't hold its bytes for as long as the job is listed
+            job.data = None
+            metrics.increment("upload_jobs_finished_total", status=job.status)
+            metrics.observe("upload_job_run_seconds", job.run_seconds)